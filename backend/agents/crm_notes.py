@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, get_buffer_string
+import asyncio
+import json
+import os
+import time
+import logging
+from .memory import get_thread_history
+from .window import count_text_tokens
+from ..cache import TTLCache
+from ..database import Database
+from ..deps import get_db_pool, lc_llm
+
+logger = logging.getLogger(__name__)
+
+CRM_SUMMARY_IDLE_SECONDS = float(os.getenv("CRM_SUMMARY_IDLE_SECONDS", "120"))
+CRM_SUMMARY_EVERY_TURNS = int(os.getenv("CRM_SUMMARY_EVERY_TURNS", "6"))
+CRM_SUMMARY_BATCH_SIZE = int(os.getenv("CRM_SUMMARY_BATCH_SIZE", "8"))
+CRM_SUMMARY_MAX_SESSIONS = int(os.getenv("CRM_SUMMARY_MAX_SESSIONS", "10000"))
+CRM_SUMMARY_TRANSCRIPT_TOKENS = int(os.getenv("CRM_SUMMARY_TRANSCRIPT_TOKENS", "1500"))
+CRM_SUMMARY_TICK_SECONDS = float(os.getenv("CRM_SUMMARY_TICK_SECONDS", "5"))
+CRM_SUMMARY_MAX_CHARS = 600
+
+BATCH_SUMMARY_PROMPT = (
+    "You write CRM notes for a sales team. For each numbered website chat below, summarize in "
+    "1-2 sentences who the visitor is, what they need and any commitments or next steps. "
+    "Include contact details the visitor shared. Reply with a JSON object mapping each chat "
+    "number (as a string) to its summary and nothing else.\n\n{transcripts}"
+)
+
+class CRMSummarizer:
+    """Background, debounced CRM summarization of chat sessions into lead notes
+
+    The chat path only records that a turn happened. A session becomes due once
+    it has been idle for ``idle_seconds`` or has accumulated ``every_turns``
+    turns since its last summary; due sessions are summarized ``batch_size`` at
+    a time in a single model call and written with one UPDATE.
+    """
+
+    def __init__(self, idle_seconds: float, every_turns: int, batch_size: int, max_sessions: int):
+        self.idle_seconds = idle_seconds
+        self.every_turns = every_turns
+        self.batch_size = batch_size
+        self.max_sessions = max_sessions
+        # session_key -> {tenant_id, lead_id, turns, last_turn}
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        # Latest summary per session, returned as notes_for_crm on later turns
+        self.latest = TTLCache("crm_notes", max_sessions, 24 * 3600)
+
+    def note_turn(self, session_key: str, tenant_id: str, lead_id: str) -> None:
+        """Record a completed turn for a session linked to a lead; never awaits"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        pending = self._pending.pop(session_key, None)
+        if pending is None:
+            if len(self._pending) >= self.max_sessions:
+                logger.warning("CRM summary queue full; skipping session")
+                return
+            pending = {"tenant_id": tenant_id, "lead_id": lead_id, "turns": 0}
+        pending["lead_id"] = lead_id
+        pending["turns"] += 1
+        pending["last_turn"] = time.monotonic()
+        self._pending[session_key] = pending
+        if pending["turns"] >= self.every_turns:
+            self._wakeup.set()
+
+    def _take_due(self, flush: bool = False) -> List[Tuple[str, Dict[str, Any]]]:
+        now = time.monotonic()
+        due = [
+            key for key, p in self._pending.items()
+            if flush or p["turns"] >= self.every_turns or now - p["last_turn"] >= self.idle_seconds
+        ]
+        return [(key, self._pending.pop(key)) for key in due]
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), CRM_SUMMARY_TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            closing = self._closing
+            await self._process(self._take_due(flush=closing))
+            if closing and not self._pending:
+                return
+
+    async def _process(self, due: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            try:
+                await self._summarize_batch(batch)
+            except Exception as e:
+                logger.error(f"CRM summary batch of {len(batch)} sessions failed: {str(e)}")
+
+    @staticmethod
+    async def _transcript(session_key: str) -> str:
+        """Recent conversation text within the token cap, prefixed by the rolling summary"""
+        history = get_thread_history(session_key)
+        messages: List[BaseMessage] = await history.aget_messages()
+        summary, _ = await history.aget_summary()
+        kept: List[BaseMessage] = []
+        budget = CRM_SUMMARY_TRANSCRIPT_TOKENS
+        for message in reversed(messages):
+            budget -= count_text_tokens(str(message.content))
+            if budget < 0 and kept:
+                break
+            kept.append(message)
+        text = get_buffer_string(list(reversed(kept)), human_prefix="Visitor", ai_prefix="Assistant")
+        return f"Earlier: {summary}\n{text}" if summary else text
+
+    async def _summarize_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        transcripts = await asyncio.gather(*[self._transcript(key) for key, _ in batch])
+        numbered = [(str(i + 1), key, p, t) for i, ((key, p), t) in enumerate(zip(batch, transcripts)) if t]
+        if not numbered:
+            return
+
+        prompt = BATCH_SUMMARY_PROMPT.format(
+            transcripts="\n\n".join(f"### Chat {n}\n{t}" for n, _, _, t in numbered)
+        )
+        result = await lc_llm().bind(response_format={"type": "json_object"}).ainvoke(prompt)
+        summaries: Dict[str, str] = json.loads(result.content)
+
+        rows = []
+        for n, key, pending, _ in numbered:
+            summary = " ".join(str(summaries.get(n, "")).split())[:CRM_SUMMARY_MAX_CHARS]
+            if summary:
+                self.latest.set(key, summary)
+                rows.append((pending["tenant_id"], pending["lead_id"], summary))
+        if rows:
+            updated = await Database(await get_db_pool()).update_lead_summaries(rows)
+            logger.info(f"Wrote CRM summaries for {updated} of {len(rows)} leads")
+
+    async def close(self) -> None:
+        """Summarize every pending session, then stop the background task"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+crm_summarizer = CRMSummarizer(
+    CRM_SUMMARY_IDLE_SECONDS, CRM_SUMMARY_EVERY_TURNS, CRM_SUMMARY_BATCH_SIZE, CRM_SUMMARY_MAX_SESSIONS
+)
@@ -0,0 +1,79 @@
+from typing import List, Optional
+import hashlib
+import math
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai | hash
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+
+class EmbeddingProvider:
+    """Interface for turning text into fixed-size vectors"""
+
+    dim: int
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings; one API call per batch of texts"""
+
+    def __init__(self, model: str, dim: int):
+        from langchain_openai import OpenAIEmbeddings
+        self.dim = dim
+        self._client = OpenAIEmbeddings(
+            model=model,
+            dimensions=dim,
+            api_key=os.getenv("OPENAI_API_KEY")
+        )
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return await self._client.aembed_documents(texts)
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """Deterministic local embeddings for offline tests and development
+
+    Tokens are hashed into buckets with a signed count, then L2-normalized, so
+    texts sharing words land close together under cosine distance.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+_provider: Optional[EmbeddingProvider] = None
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Get or create the configured embedding provider"""
+    global _provider
+    if _provider is None:
+        if EMBEDDING_PROVIDER == "hash":
+            _provider = HashEmbeddingProvider(EMBEDDING_DIM)
+        else:
+            _provider = OpenAIEmbeddingProvider(EMBEDDING_MODEL, EMBEDDING_DIM)
+        logger.info(f"Embedding provider: {EMBEDDING_PROVIDER} ({EMBEDDING_DIM} dims)")
+    return _provider
+
+def set_embedding_provider(provider: EmbeddingProvider) -> None:
+    """Override the embedding provider (tests, benchmarks)"""
+    global _provider
+    _provider = provider
+
+def to_pgvector(vector: List[float]) -> str:
+    """Serialize a vector to pgvector's text input format"""
+    return "[" + ",".join(f"{v:.7g}" for v in vector) + "]"
@@ -1,105 +1,236 @@
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from .state import AgentState
-from .memory import get_thread_history, retrieve_persistent_memory
-from ..deps import lc_llm
+from .memory import get_thread_history, retrieve_persistent_memory, store_persistent_memory
+from .window import (
+    count_text_tokens, estimate_turn_tokens, history_settings, make_history_window, max_reply_tokens
+)
+from .scheduler import AdmissionRejected, llm_scheduler
+from .prompts import compile_system_prompt
+from .crm_notes import crm_summarizer
+from .resilience import reply_model
+from ..cache import TTLCache, normalize_input, prompt_hash, response_cache
+from ..metrics import instrument_node, record_llm_usage
+from ..transcripts import transcript_writer
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Tag on the reply model call so streams can skip auxiliary LLM calls (e.g. summaries)
+REPLY_TAG = "agent_reply"
+
 def build_prompt(system_prompt: str) -> ChatPromptTemplate:
-    """Build chat prompt template with system, history, and human components"""
+    """Build chat prompt template with system, history, context, and human components
+    
+    Ordered from most to least stable so provider prompt caching can reuse the
+    longest prefix: the compiled system prompt is a literal message (not a
+    template), history only grows between turns, and per-turn retrieved docs
+    come last, just before the new input.
+    """
     return ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
+        SystemMessage(system_prompt),
         MessagesPlaceholder("history"),
+        MessagesPlaceholder("context", optional=True),
         ("human", "{input}")
     ])
 
-def make_chain(system_prompt: str):
-    """Create chain with message history"""
-    prompt = build_prompt(system_prompt)
-    llm = lc_llm()
-    base_chain = prompt | llm
+def make_chain(system_prompt: str, settings: Optional[Dict[str, Any]] = None):
+    """Create chain that fits the supplied thread history into the agent's token budget
     
-    return RunnableWithMessageHistory(
-        base_chain,
-        lambda config: get_thread_history(config["configurable"]["session_id"]),
-        input_messages_key="input",
-        history_messages_key="history",
-    )
+    History is loaded by the graph (concurrently with retrieval) and passed in
+    as ``history``; ``n_llm`` appends the new turn once the reply is generated.
+    """
+    prompt = build_prompt(system_prompt)
+    llm = reply_model(settings or {})
+    budget = history_settings(settings or {})
+    window = make_history_window(budget["token_budget"], budget["keep_turns"])
+    return RunnablePassthrough.assign(history=RunnableLambda(window)) | prompt | llm.with_config(tags=[REPLY_TAG])
+
+# Compiled chains memoized per agent and prompt/settings content
+_chains = TTLCache("chains", int(os.getenv("CHAIN_CACHE_MAX_ENTRIES", "500")), float("inf"))
+
+def get_chain(agent_id: str, system_prompt: str, settings: Optional[Dict[str, Any]] = None):
+    """Get the memoized chain for an agent, building it on first use or after edits"""
+    key = (agent_id, prompt_hash(system_prompt, settings or {}))
+    chain = _chains.get(key)
+    if chain is None:
+        chain = make_chain(system_prompt, settings)
+        _chains.set(key, chain)
+    return chain
+
+# Inputs that never benefit from memory retrieval
+SMALL_TALK = {
+    "hi", "hello", "hey", "hiya", "yo", "thanks", "thank you", "thx", "ok", "okay", "cool",
+    "great", "yes", "no", "sure", "bye", "goodbye", "good morning", "good afternoon",
+    "good evening", "hi there", "hello there", "hey there",
+}
+
+# Agents whose last retrieval found nothing skip retrieval until this expires
+# or this worker stores a memory for them
+_empty_memory = TTLCache("empty_memory", int(os.getenv("EMPTY_MEMORY_MAX_ENTRIES", "5000")),
+                         float(os.getenv("EMPTY_MEMORY_TTL_SECONDS", "60")))
+
+def is_small_talk(text: str) -> bool:
+    normalized = normalize_input(text)
+    return not normalized or normalized in SMALL_TALK
+
+def _session_key(state: AgentState) -> str:
+    return f"{state['tenant_id']}:{state['agent_id']}:{state['session_id']}"
 
 # Graph nodes
-def n_prepare(state: AgentState) -> AgentState:
-    """Prepare node - retrieve persistent memory if enabled"""
-    if state.get("persist_memory", False):
-        # Retrieve relevant docs from pgvector
-        docs = retrieve_persistent_memory(
-            state["tenant_id"], 
-            state["agent_id"], 
-            state["input"]
-        )
-        state["docs"] = docs
-        logger.info(f"Retrieved {len(docs)} docs from persistent memory")
-    else:
-        state["docs"] = []
-    
-    return state
+async def n_load_history(state: AgentState) -> Dict[str, Any]:
+    """Load history node - fetch the session's thread history"""
+    history = await get_thread_history(_session_key(state)).aget_messages()
+    return {"history": list(history)}
+
+async def n_retrieve(state: AgentState) -> Dict[str, Any]:
+    """Retrieve node - fetch relevant docs from persistent memory (pgvector)"""
+    key = (state["tenant_id"], str(state["agent_id"]))
+    docs = await retrieve_persistent_memory(state["tenant_id"], state["agent_id"], state["input"])
+    if not docs:
+        _empty_memory.set(key, True)
+    logger.info(f"Retrieved {len(docs)} docs from persistent memory")
+    return {"docs": docs}
+
+def route_prefetch(state: AgentState) -> List[str]:
+    """Start history load and (when worthwhile) retrieval in the same step"""
+    nodes = [] if state.get("history_preloaded") else ["load_history"]
+    if (state.get("persist_memory", False)
+            and not is_small_talk(state["input"])
+            and not _empty_memory.get((state["tenant_id"], str(state["agent_id"])))):
+        nodes.append("retrieve")
+    return nodes or ["llm"]
+
+def route_after_llm(state: AgentState) -> str:
+    """Only visit summarize when the session feeds CRM notes"""
+    if state.get("lead_id") or crm_summarizer.latest.get(_session_key(state)) is not None:
+        return "summarize"
+    return END
 
-def n_llm(state: AgentState) -> AgentState:
+def _log_turn(state: AgentState, received_at: datetime) -> None:
+    """Queue the turn for the write-behind transcript log"""
+    transcript_writer.log_turn(
+        state["tenant_id"], state["agent_id"], state["session_id"], state.get("lead_id"),
+        state["input"], state["response"], received_at
+    )
+
+async def n_llm(state: AgentState) -> AgentState:
     """LLM node - generate response using chain with history"""
+    received_at = datetime.now(timezone.utc)
     try:
-        # Add retrieved docs to system prompt if available
-        system_prompt = state["system_prompt"]
+        # Retrieved docs go in as a prompt variable so the chain can be reused
+        context = []
         if state.get("docs"):
-            docs_context = "\n\nRelevant context:\n" + "\n".join(state["docs"])
-            system_prompt += docs_context
+            context = [SystemMessage("Relevant context:\n" + "\n".join(state["docs"]))]
         
-        chain = make_chain(system_prompt)
-        session_key = f"{state['tenant_id']}:{state['agent_id']}:{state['session_id']}"
+        system_prompt = compile_system_prompt(
+            state["agent_id"], state["system_prompt"], state.get("identity"), state.get("mission")
+        )
+        chain = get_chain(state["agent_id"], system_prompt, state.get("settings"))
+        session_key = _session_key(state)
+        history = get_thread_history(session_key)
         
-        result = chain.invoke(
-            {"input": state["input"]},
-            config={"configurable": {"session_id": session_key}}
+        # Opt-in cache for opening messages; only used with empty history and no docs
+        cache_options = (state.get("settings") or {}).get("response_cache") or {}
+        cacheable = bool(cache_options.get("enabled")) and not context and not state.get("history")
+        if cacheable:
+            phash = prompt_hash(system_prompt)
+            cached = await response_cache.get(state["agent_id"], phash, state["input"], cache_options)
+            if cached is not None:
+                turn = [HumanMessage(state["input"]), AIMessage(cached)]
+                await history.aadd_messages(turn)
+                state["history"] = list(state.get("history") or []) + turn
+                state["response"] = cached
+                _log_turn(state, received_at)
+                logger.info(f"Served cached response for session {session_key}")
+                return state
+        
+        # Per-tenant admission control and fair queueing for this worker's LLM slots
+        est_tokens = estimate_turn_tokens(
+            system_prompt, state["input"], state.get("history") or [], context, state.get("settings") or {}
         )
+        async with llm_scheduler.slot(state["tenant_id"], est_tokens) as settle:
+            result = await chain.ainvoke(
+                {"input": state["input"], "context": context, "history": state.get("history") or []},
+                config={"configurable": {"session_id": session_key}}
+            )
         
         state["response"] = result.content.strip()
+        # Charge the tenant what the call used rather than the max_tokens reservation
+        usage = result.usage_metadata or {}
+        actual_tokens = usage.get("total_tokens") or (
+            est_tokens - max_reply_tokens(state.get("settings") or {}) + count_text_tokens(state["response"])
+        )
+        await settle(actual_tokens)
+        turn = [HumanMessage(state["input"]), AIMessage(state["response"])]
+        await history.aadd_messages(turn)
+        # Returned history includes this turn, so a connection can keep it for the next one
+        state["history"] = list(state.get("history") or []) + turn
+        _log_turn(state, received_at)
+        record_llm_usage(state["tenant_id"], str(state["agent_id"]), result.usage_metadata)
         logger.info(f"Generated response for session {session_key}")
         
+        if cacheable:
+            await response_cache.set(state["agent_id"], phash, state["input"], state["response"], cache_options)
+        
+        if state.get("persist_memory", False):
+            # Queued for write-behind embedding; does not delay the reply
+            _empty_memory.invalidate((state["tenant_id"], str(state["agent_id"])))
+            store_persistent_memory(
+                state["tenant_id"],
+                state["agent_id"],
+                f"User: {state['input']}\nAgent: {state['response']}",
+                {"session_id": state["session_id"]}
+            )
+        
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"LLM generation failed: {str(e)}")
         state["response"] = "I apologize, but I'm having trouble responding right now. Please try again or contact support."
     
     return state
 
-def n_summarize(state: AgentState) -> AgentState:
-    """Summarize node - create CRM notes"""
-    response = state.get("response", "")
-    user_input = state.get("input", "")
-    
-    # Simple summary for CRM (keep under 600 chars)
-    summary = f"User: {user_input[:200]}... Agent responded with assistance."
-    if len(summary) > 600:
-        summary = summary[:597] + "..."
+async def n_summarize(state: AgentState) -> AgentState:
+    """Summarize node - queue the session for background CRM notes
     
-    state["notes_for_crm"] = summary
+    Summaries are generated off the request path (see ``crm_notes``); the
+    reply carries the latest one already written for this session, if any.
+    """
+    session_key = _session_key(state)
+    if state.get("lead_id"):
+        crm_summarizer.note_turn(session_key, state["tenant_id"], state["lead_id"])
+    state["notes_for_crm"] = crm_summarizer.latest.get(session_key)
     
     return state
 
 def compile_graph():
-    """Compile the LangGraph workflow"""
+    """Compile the LangGraph workflow
+    
+    History load and retrieval start together in the first step, so pre-LLM
+    latency is the slower of the two rather than their sum. Retrieval is skipped
+    for small talk and for agents with no stored memories, and the history load
+    when the caller already holds it; summarize only runs for sessions that
+    feed CRM notes.
+    """
     graph = StateGraph(AgentState)
     
     # Add nodes
-    graph.add_node("prepare", n_prepare)
-    graph.add_node("llm", n_llm)
-    graph.add_node("summarize", n_summarize)
+    graph.add_node("load_history", instrument_node("load_history", n_load_history))
+    graph.add_node("retrieve", instrument_node("retrieve", n_retrieve))
+    graph.add_node("llm", instrument_node("llm", n_llm))
+    graph.add_node("summarize", instrument_node("summarize", n_summarize))
     
     # Define edges
-    graph.set_entry_point("prepare")
-    graph.add_edge("prepare", "llm")
-    graph.add_edge("llm", "summarize")
+    graph.add_conditional_edges(START, route_prefetch, ["load_history", "retrieve", "llm"])
+    graph.add_edge("load_history", "llm")
+    graph.add_edge("retrieve", "llm")
+    graph.add_conditional_edges("llm", route_after_llm, ["summarize", END])
     graph.add_edge("summarize", END)
     
-    return graph.compile()
\ No newline at end of file
+    return graph.compile()
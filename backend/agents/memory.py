@@ -1,34 +1,283 @@
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from typing import Dict, List
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import json
+import os
+import time
+import uuid
 import logging
+from .embeddings import EMBEDDING_DIM, get_embedding_provider, to_pgvector
+from ..deps import get_db_pool, get_redis
 
 logger = logging.getLogger(__name__)
 
-# In-memory storage for thread-based chat history
-_session_histories: Dict[str, InMemoryChatMessageHistory] = {}
+# History backend configuration
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")  # memory | redis
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "100"))
+HISTORY_TTL_SECONDS = int(os.getenv("HISTORY_TTL_SECONDS", "86400"))
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_IDLE_SECONDS = int(os.getenv("HISTORY_IDLE_SECONDS", "3600"))
 
-def get_thread_history(session_id: str) -> InMemoryChatMessageHistory:
+class BoundedInMemoryHistory(InMemoryChatMessageHistory):
+    """In-process chat history capped to the most recent messages
+    
+    Also carries the rolling summary of turns folded out of the prompt window.
+    ``summary_upto`` and ``total_added`` are absolute message counts so the
+    summary cursor survives trimming of the head of the list.
+    """
+    
+    summary: str = ""
+    summary_upto: int = 0
+    total_added: int = 0
+    
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        super().add_messages(messages)
+        self.total_added += len(messages)
+        if len(self.messages) > HISTORY_MAX_MESSAGES:
+            del self.messages[:-HISTORY_MAX_MESSAGES]
+    
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.add_messages(messages)
+    
+    async def aget_summary(self) -> Tuple[str, int]:
+        """Return the rolling summary and how many leading messages it covers"""
+        start = self.total_added - len(self.messages)
+        return self.summary, max(0, self.summary_upto - start)
+    
+    async def aset_summary(self, summary: str, folded: int) -> None:
+        """Store the rolling summary covering the first ``folded`` messages"""
+        self.summary = summary
+        self.summary_upto = self.total_added - len(self.messages) + folded
+
+class RedisSessionHistory(BaseChatMessageHistory):
+    """Redis-backed chat history stored as a capped list with a per-session TTL
+    
+    Only the async API is supported; the graph runs through ``ainvoke``.
+    Summary state lives in a companion hash (``summary``, ``upto``, ``total``).
+    """
+    
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.key = f"chat:history:{session_id}"
+        self.meta_key = f"{self.key}:meta"
+    
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        raise NotImplementedError("RedisSessionHistory only supports async access")
+    
+    async def aget_messages(self) -> List[BaseMessage]:
+        client = await get_redis()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.lrange(self.key, 0, -1)
+            pipe.expire(self.key, HISTORY_TTL_SECONDS)
+            pipe.expire(self.meta_key, HISTORY_TTL_SECONDS)
+            raw, _, _ = await pipe.execute()
+        return messages_from_dict([json.loads(item) for item in raw])
+    
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        payload = [
+            json.dumps(message_to_dict(m), separators=(",", ":"), ensure_ascii=False)
+            for m in messages
+        ]
+        client = await get_redis()
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.rpush(self.key, *payload)
+            pipe.ltrim(self.key, -HISTORY_MAX_MESSAGES, -1)
+            pipe.expire(self.key, HISTORY_TTL_SECONDS)
+            pipe.hincrby(self.meta_key, "total", len(payload))
+            pipe.expire(self.meta_key, HISTORY_TTL_SECONDS)
+            await pipe.execute()
+    
+    async def _list_start(self, client) -> Tuple[int, str, int]:
+        """Absolute index of the first stored message, plus the summary state"""
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.meta_key, "summary", "upto", "total")
+            pipe.llen(self.key)
+            (summary, upto, total), length = await pipe.execute()
+        return int(total or 0) - length, summary or "", int(upto or 0)
+    
+    async def aget_summary(self) -> Tuple[str, int]:
+        """Return the rolling summary and how many leading messages it covers"""
+        client = await get_redis()
+        start, summary, upto = await self._list_start(client)
+        return summary, max(0, upto - start)
+    
+    async def aset_summary(self, summary: str, folded: int) -> None:
+        """Store the rolling summary covering the first ``folded`` messages"""
+        client = await get_redis()
+        start, _, _ = await self._list_start(client)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.meta_key, mapping={"summary": summary, "upto": start + folded})
+            pipe.expire(self.meta_key, HISTORY_TTL_SECONDS)
+            await pipe.execute()
+    
+    def clear(self) -> None:
+        raise NotImplementedError("RedisSessionHistory only supports async access")
+    
+    async def aclear(self) -> None:
+        client = await get_redis()
+        await client.delete(self.key, self.meta_key)
+
+class LRUHistoryStore:
+    """Process-local session histories with a max session count and idle eviction"""
+    
+    def __init__(self, max_sessions: int, idle_seconds: int):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, BoundedInMemoryHistory]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+    
+    def get(self, session_id: str) -> BoundedInMemoryHistory:
+        now = time.monotonic()
+        history = self._sessions.get(session_id)
+        if history is None:
+            history = BoundedInMemoryHistory()
+            self._sessions[session_id] = history
+            logger.info(f"Created new thread history for session: {session_id}")
+        else:
+            self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = now
+        self._evict(now)
+        return history
+    
+    def discard(self, session_id: str) -> bool:
+        self._last_access.pop(session_id, None)
+        return self._sessions.pop(session_id, None) is not None
+    
+    def _evict(self, now: float) -> None:
+        # Least recently used sessions sit at the front of the ordered dict
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            idle = now - self._last_access[oldest] > self.idle_seconds
+            if not idle and len(self._sessions) <= self.max_sessions:
+                break
+            self.discard(oldest)
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+# In-memory storage for thread-based chat history (default single-node backend)
+_session_histories = LRUHistoryStore(HISTORY_MAX_SESSIONS, HISTORY_IDLE_SECONDS)
+
+def get_thread_history(session_id: str) -> BaseChatMessageHistory:
     """Get or create thread-based chat history for session"""
-    if session_id not in _session_histories:
-        _session_histories[session_id] = InMemoryChatMessageHistory()
-        logger.info(f"Created new thread history for session: {session_id}")
-    return _session_histories[session_id]
+    if HISTORY_BACKEND == "redis":
+        return RedisSessionHistory(session_id)
+    return _session_histories.get(session_id)
 
-def clear_thread_history(session_id: str) -> None:
+async def clear_thread_history(session_id: str) -> None:
     """Clear thread history for session"""
-    if session_id in _session_histories:
-        del _session_histories[session_id]
+    if HISTORY_BACKEND == "redis":
+        await RedisSessionHistory(session_id).aclear()
         logger.info(f"Cleared thread history for session: {session_id}")
+    elif _session_histories.discard(session_id):
+        logger.info(f"Cleared thread history for session: {session_id}")
+
+# Persistent memory (pgvector)
+MEMORY_QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", "10000"))
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "64"))
+MEMORY_FLUSH_SECONDS = float(os.getenv("MEMORY_FLUSH_SECONDS", "0.5"))
+MEMORY_EF_SEARCH = int(os.getenv("MEMORY_EF_SEARCH", "64"))
+
+class MemoryWriter:
+    """Write-behind queue that batches embedding calls and multi-row inserts
+    
+    ``submit`` never awaits, so storing memory adds no latency to a chat turn.
+    A background task drains up to ``batch_size`` items (or whatever arrived
+    within ``flush_seconds``), embeds them in one provider call and inserts them
+    with a single statement.
+    """
+    
+    def __init__(self, batch_size: int, flush_seconds: float, queue_size: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+    
+    def submit(self, item: Tuple[str, str, str, Dict[str, Any]]) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            logger.warning("Persistent memory queue full; dropping memory item")
+    
+    async def _next_batch(self) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error(f"Persistent memory write of {len(batch)} items failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _write(self, batch: List[Tuple[str, str, str, Dict[str, Any]]]) -> None:
+        vectors = await get_embedding_provider().aembed([content for _, _, content, _ in batch])
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO agent_memory (id, tenant_id, agent_id, content, metadata, embedding)
+                SELECT id, tenant_id, agent_id, content, metadata::jsonb, embedding::vector
+                FROM unnest($1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[])
+                    AS t(id, tenant_id, agent_id, content, metadata, embedding)
+            """,
+                [uuid.uuid4() for _ in batch],
+                [tenant_id for tenant_id, _, _, _ in batch],
+                [agent_id for _, agent_id, _, _ in batch],
+                [content for _, _, content, _ in batch],
+                [json.dumps(metadata) for _, _, _, metadata in batch],
+                [to_pgvector(v) for v in vectors])
+        logger.info(f"Stored {len(batch)} persistent memory items")
+    
+    async def close(self) -> None:
+        """Flush queued items and stop the background task"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+memory_writer = MemoryWriter(MEMORY_BATCH_SIZE, MEMORY_FLUSH_SECONDS, MEMORY_QUEUE_SIZE)
 
-# Persistent memory functions (stub for pgvector integration)
-def retrieve_persistent_memory(tenant_id: str, agent_id: str, query: str, limit: int = 5) -> List[str]:
-    """Retrieve relevant memory chunks from pgvector (future implementation)"""
-    # TODO: Implement semantic search using pgvector
-    logger.info(f"Persistent memory retrieval requested for tenant {tenant_id}, agent {agent_id}")
-    return []
+async def retrieve_persistent_memory(tenant_id: str, agent_id: str, query: str, limit: int = 5) -> List[str]:
+    """Retrieve the top-k memory chunks for a tenant's agent by cosine similarity"""
+    [vector] = await get_embedding_provider().aembed([query])
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Tenant filtering happens after the HNSW scan, so widen the candidate list
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {MEMORY_EF_SEARCH}")
+            rows = await conn.fetch("""
+                SELECT content FROM agent_memory
+                WHERE tenant_id = $1 AND agent_id = $2
+                ORDER BY embedding <=> $3::vector
+                LIMIT $4
+            """, tenant_id, agent_id, to_pgvector(vector), limit)
+    return [row["content"] for row in rows]
 
 def store_persistent_memory(tenant_id: str, agent_id: str, content: str, metadata: Dict = None) -> None:
-    """Store content in persistent memory with vector embedding (future implementation)"""
-    # TODO: Generate embeddings and store in agent_memory table
-    logger.info(f"Persistent memory storage requested for tenant {tenant_id}, agent {agent_id}")
-    pass
\ No newline at end of file
+    """Queue content for embedding and storage in the agent_memory table"""
+    memory_writer.submit((tenant_id, agent_id, content, metadata or {}))
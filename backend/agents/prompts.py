@@ -0,0 +1,101 @@
+from typing import Any, Dict, List
+import logging
+from ..cache import compiled_prompt_cache, prompt_hash
+
+logger = logging.getLogger(__name__)
+
+# Fields rendered explicitly (or deliberately left out of the prompt)
+_IDENTITY_FIELDS = {"name", "brand", "tone", "capabilities", "personality", "avatar_url"}
+_MISSION_FIELDS = {"mission", "guidelines", "compliance", "routing_options", "runtime"}
+
+def _label(key: str) -> str:
+    return key.replace("_", " ").capitalize()
+
+def _as_list(value: Any) -> List[Any]:
+    """Admin input is free-form JSON; treat a single value as a one-item list"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def _bullets(items: Any) -> List[str]:
+    return [f"- {item}" for item in _as_list(items) if item not in (None, "")]
+
+def _value(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(v) for v in value)
+    return str(value)
+
+def _extras(config: Dict[str, Any], known: set) -> List[str]:
+    """Render fields without a dedicated section, in key order so output is deterministic"""
+    lines = []
+    for key in sorted(k for k in config if k not in known):
+        value = config[key]
+        if isinstance(value, dict):
+            lines.extend(f"{_label(key)} - {_label(k)}: {_value(v)}" for k, v in sorted(value.items()))
+        elif value not in (None, "", [], {}):
+            lines.append(f"{_label(key)}: {_value(value)}")
+    return lines
+
+def render_system_prompt(system_prompt: str, identity: Dict[str, Any], mission: Dict[str, Any]) -> str:
+    """Render the agent's instructions, identity and mission into one system prompt
+
+    Output depends only on the inputs (sections in a fixed order, free-form
+    keys sorted), so an unchanged agent always yields byte-identical text and
+    the provider can cache it as a prompt prefix.
+    """
+    identity = identity or {}
+    mission = mission or {}
+    sections = [system_prompt.strip()]
+
+    about = []
+    if identity.get("name") and identity.get("brand"):
+        about.append(f"You are {identity['name']}, the assistant for {identity['brand']}.")
+    elif identity.get("name"):
+        about.append(f"You are {identity['name']}.")
+    elif identity.get("brand"):
+        about.append(f"You are the assistant for {identity['brand']}.")
+    if identity.get("tone"):
+        about.append(f"Tone: {identity['tone']}")
+    if identity.get("capabilities"):
+        about.append("Capabilities: " + ", ".join(
+            str(c).replace("_", " ") for c in _as_list(identity["capabilities"])
+        ))
+    personality = identity.get("personality")
+    if isinstance(personality, dict):
+        for key, value in sorted(personality.items()):
+            about.append(f"{_label(key)}: {_value(value)}")
+    elif personality not in (None, "", []):
+        about.append(f"Personality: {_value(personality)}")
+    about.extend(_extras(identity, _IDENTITY_FIELDS))
+    if about:
+        sections.append("## Identity\n" + "\n".join(about))
+
+    if mission.get("mission"):
+        sections.append(f"## Mission\n{mission['mission']}")
+    if mission.get("guidelines"):
+        sections.append("## Guidelines\n" + "\n".join(_bullets(mission["guidelines"])))
+    if mission.get("compliance"):
+        sections.append("## Compliance (always follow)\n" + "\n".join(_bullets(mission["compliance"])))
+    if mission.get("routing_options"):
+        sections.append(
+            "## Routing options\nWhen the visitor's intent matches, point them to:\n"
+            + "\n".join(_bullets(mission["routing_options"]))
+        )
+    extras = _extras(mission, _MISSION_FIELDS)
+    if extras:
+        sections.append("## Additional instructions\n" + "\n".join(extras))
+
+    return "\n\n".join(s for s in sections if s)
+
+def compile_system_prompt(agent_id: str, system_prompt: str, identity: Dict[str, Any],
+                          mission: Dict[str, Any]) -> str:
+    """Get the rendered system prompt for an agent, cached by content hash"""
+    key = (str(agent_id), prompt_hash(system_prompt, identity or {}, mission or {}))
+    compiled = compiled_prompt_cache.get(key)
+    if compiled is None:
+        compiled = render_system_prompt(system_prompt, identity, mission)
+        compiled_prompt_cache.set(key, compiled)
+        logger.info(f"Compiled system prompt for agent {agent_id} ({len(compiled)} chars)")
+    return compiled
@@ -0,0 +1,281 @@
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+import logging
+from ..deps import lc_llm
+from ..metrics import LLM_ROUTE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Defaults for agents without mission.runtime.model overrides
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL", "")
+LLM_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT_SECONDS", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+class ModelUnavailable(Exception):
+    """Every model route is failing or its circuit is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one model route
+
+    Opens after ``failure_threshold`` failures in a row (errors or missed
+    first-token deadlines). While open the route is skipped; after
+    ``reset_seconds`` a single trial request is let through (half-open) and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, route: str, failure_threshold: int, reset_seconds: float):
+        self.route = route
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"Circuit closed for model route {self.route}")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def release_trial(self) -> None:
+        """Give back a half-open trial whose request ended without a verdict (e.g. cancelled)"""
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial:
+                logger.warning(f"Circuit opened for model route {self.route} after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_breaker(route: str) -> CircuitBreaker:
+    breaker = _breakers.get(route)
+    if breaker is None:
+        breaker = _breakers[route] = CircuitBreaker(route, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+    return breaker
+
+def breaker_states() -> Dict[str, str]:
+    """Current circuit state per model route on this worker"""
+    return {route: breaker.state for route, breaker in _breakers.items()}
+
+def model_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve an agent's model, fallback and latency SLOs from its runtime settings
+
+    ``settings["model"]`` may set ``name``, ``base_url``, ``temperature``,
+    ``max_tokens``, ``first_token_timeout_seconds``, ``timeout_seconds`` and
+    ``fallback`` (``{"name", "base_url"}``, or ``false`` to disable).
+    """
+    model = settings.get("model") or {}
+    fallback = model.get("fallback")
+    if fallback is None and (LLM_FALLBACK_MODEL or LLM_FALLBACK_BASE_URL):
+        fallback = {"name": LLM_FALLBACK_MODEL or None, "base_url": LLM_FALLBACK_BASE_URL or None}
+    return {
+        "name": model.get("name"),
+        "base_url": model.get("base_url"),
+        "temperature": model.get("temperature"),
+        "max_tokens": model.get("max_tokens"),
+        "fallback": fallback or None,
+        "first_token_timeout": float(model.get("first_token_timeout_seconds", LLM_FIRST_TOKEN_TIMEOUT_SECONDS)),
+        "timeout": float(model.get("timeout_seconds", LLM_TIMEOUT_SECONDS)),
+    }
+
+def _route_name(llm: BaseChatModel) -> str:
+    name = getattr(llm, "model_name", None) or llm._llm_type
+    base_url = getattr(llm, "openai_api_base", None) or "default"
+    return f"{name}@{base_url}"
+
+async def _close_stream(task: asyncio.Future, stream: AsyncIterator) -> None:
+    """Cancel a pending read and close its stream (drops the HTTP response)"""
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    try:
+        await stream.aclose()
+    except Exception:
+        pass
+
+class HedgedChatModel(BaseChatModel):
+    """Chat model that enforces latency SLOs over a primary and an optional fallback
+
+    The primary is streamed first. If it has not produced a first token within
+    ``first_token_timeout`` seconds, the fallback is started alongside it and
+    whichever produces a first token first wins; the other stream is cancelled.
+    Errors before the first token cascade straight to the fallback. Each route
+    has a circuit breaker, so a degraded primary is skipped until it recovers.
+    The whole response must complete within ``timeout`` seconds.
+    """
+
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+    first_token_timeout: float = LLM_FIRST_TOKEN_TIMEOUT_SECONDS
+    timeout: float = LLM_TIMEOUT_SECONDS
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat"
+
+    def _routes(self) -> List[Tuple[str, BaseChatModel]]:
+        routes = [("primary", self.primary)]
+        if self.fallback is not None:
+            routes.append(("fallback", self.fallback))
+        return routes
+
+    async def _first_chunk(self, messages: List[BaseMessage], stop: Optional[List[str]], deadline: float,
+                           **kwargs: Any) -> Tuple[str, BaseChatModel, ChatGenerationChunk, AsyncIterator]:
+        """Start routes in order, hedging on missed first-token deadlines; return the winner"""
+        loop = asyncio.get_running_loop()
+        queued = self._routes()
+        pending: Dict[asyncio.Future, Tuple[str, BaseChatModel, AsyncIterator]] = {}
+        error: Optional[BaseException] = None
+
+        def launch() -> float:
+            # Breakers are consulted only when a route is actually started
+            while queued:
+                kind, llm = queued.pop(0)
+                if not get_breaker(_route_name(llm)).allow():
+                    LLM_ROUTE_REQUESTS.labels(route=kind, outcome="circuit_open").inc()
+                    continue
+                stream = llm._astream(messages, stop=stop, **kwargs)
+                pending[asyncio.ensure_future(stream.__anext__())] = (kind, llm, stream)
+                break
+            return loop.time() + self.first_token_timeout
+
+        hedge_at = launch()
+        if not pending:
+            raise ModelUnavailable("All model routes have open circuits")
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    raise asyncio.TimeoutError(f"No model responded within {self.timeout}s")
+                wait_until = min(deadline, hedge_at) if queued else deadline
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=max(0.0, wait_until - now), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if queued and loop.time() >= hedge_at:
+                        # First-token SLO missed: count it against the slow routes and hedge
+                        for kind, llm, _ in pending.values():
+                            get_breaker(_route_name(llm)).record_failure()
+                            logger.warning(f"{kind} model missed {self.first_token_timeout}s first-token deadline; hedging")
+                        hedge_at = launch()
+                    continue
+                for task in done:
+                    kind, llm, stream = pending.pop(task)
+                    try:
+                        chunk = task.result()
+                    except StopAsyncIteration:
+                        error = ModelUnavailable(f"{kind} model returned an empty response")
+                    except Exception as e:
+                        error = e
+                    else:
+                        hedged = bool(pending) or kind == "fallback"
+                        LLM_ROUTE_REQUESTS.labels(route=kind, outcome="hedge_won" if hedged else "ok").inc()
+                        return kind, llm, chunk, stream
+                    get_breaker(_route_name(llm)).record_failure()
+                    LLM_ROUTE_REQUESTS.labels(route=kind, outcome="error").inc()
+                    logger.warning(f"{kind} model failed before first token: {str(error)}")
+                    await stream.aclose()
+                    if queued and not pending:
+                        # Cascade immediately rather than waiting for the hedge deadline
+                        hedge_at = launch()
+            raise error or ModelUnavailable("No model route available")
+        finally:
+            for task, (_, llm, stream) in pending.items():
+                get_breaker(_route_name(llm)).release_trial()
+                await _close_stream(task, stream)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        kind, llm, chunk, stream = await self._first_chunk(messages, stop, deadline, **kwargs)
+        breaker = get_breaker(_route_name(llm))
+        completed = False
+        try:
+            while True:
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{kind} model response exceeded {self.timeout}s")
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+            completed = True
+        except Exception:
+            breaker.record_failure()
+            LLM_ROUTE_REQUESTS.labels(route=kind, outcome="error").inc()
+            raise
+        finally:
+            await stream.aclose()
+            if completed:
+                breaker.record_success()
+            else:
+                breaker.release_trial()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        generation: Optional[ChatGenerationChunk] = None
+        async for chunk in self._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            generation = chunk if generation is None else generation + chunk
+        if generation is None:
+            raise ModelUnavailable("Model returned an empty response")
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(generation.message))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        # The graph only uses the async path; sync callers get the primary without hedging
+        return self.primary._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+def reply_model(settings: Dict[str, Any]) -> HedgedChatModel:
+    """Build the hedged reply model for an agent's runtime settings"""
+    config = model_settings(settings)
+    primary = lc_llm(config["name"], config["temperature"], config["max_tokens"], config["base_url"])
+    fallback = None
+    if config["fallback"]:
+        fallback = lc_llm(
+            config["fallback"].get("name") or config["name"], config["temperature"],
+            config["max_tokens"], config["fallback"].get("base_url")
+        )
+    return HedgedChatModel(
+        primary=primary,
+        fallback=fallback,
+        first_token_timeout=config["first_token_timeout"],
+        timeout=config["timeout"],
+    )
@@ -0,0 +1,211 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+import logging
+from ..deps import get_redis
+from ..metrics import LLM_QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+TENANT_RPM = int(os.getenv("TENANT_RPM", "60"))
+TENANT_TPM = int(os.getenv("TENANT_TPM", "100000"))
+TENANT_MAX_QUEUED = int(os.getenv("TENANT_MAX_QUEUED", "20"))
+SCHEDULER_MAX_QUEUED = int(os.getenv("SCHEDULER_MAX_QUEUED", "500"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis")  # redis | memory
+
+def _load_tenant_limits(raw: str) -> Dict[str, Dict[str, Any]]:
+    limits = json.loads(raw)
+    for tenant_id, override in limits.items():
+        if float(override.get("weight", 1.0)) <= 0:
+            raise ValueError(f"TENANT_LIMITS_JSON: weight for tenant {tenant_id} must be positive")
+    return limits
+
+# Per-tenant overrides, e.g. {"<tenant_id>": {"rpm": 120, "tpm": 200000, "weight": 2}}
+TENANT_LIMITS = _load_tenant_limits(os.getenv("TENANT_LIMITS_JSON", "{}"))
+
+class AdmissionRejected(Exception):
+    """Request refused before reaching the model; maps to HTTP 429"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _LocalWindow:
+    """Per-minute fixed-window counters for when Redis is not used"""
+
+    def __init__(self):
+        self._counts: Dict[Tuple[str, int], Tuple[int, int]] = {}
+
+    def add(self, tenant_id: str, minute: int, tokens: int, requests: int = 1) -> Tuple[int, int]:
+        counted, used = self._counts.get((tenant_id, minute), (0, 0))
+        counts = (counted + requests, used + tokens)
+        self._counts[(tenant_id, minute)] = counts
+        # Drop windows older than the current minute
+        for key in [k for k in self._counts if k[1] < minute]:
+            del self._counts[key]
+        return counts
+
+class LLMScheduler:
+    """Admission control and weighted fair queueing in front of the model call
+
+    Each request is first charged against its tenant's requests-per-minute and
+    estimated tokens-per-minute limits (Redis counters shared by all workers, or
+    local counters); the estimate is corrected with actual usage afterwards.
+    Admitted requests then wait for one of this worker's LLM slots; waiting
+    requests are granted in start-time fair queueing order, so a tenant's share
+    of slots follows its weight rather than its request volume. Queues are
+    bounded and overflow is rejected immediately.
+    """
+
+    def __init__(self, concurrency: int, tenant_max_queued: int, max_queued: int):
+        self.concurrency = concurrency
+        self.tenant_max_queued = tenant_max_queued
+        self.max_queued = max_queued
+        self._active = 0
+        self._heap: List[Tuple[float, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        self._tenant_queued: Dict[str, int] = {}
+        self._local = _LocalWindow()
+        self.wait_stats: Dict[str, Dict[str, float]] = {}
+        self.rejections: Dict[str, int] = {}
+
+    @staticmethod
+    def limits(tenant_id: str) -> Dict[str, float]:
+        override = TENANT_LIMITS.get(tenant_id, {})
+        return {
+            "rpm": float(override.get("rpm", TENANT_RPM)),
+            "tpm": float(override.get("tpm", TENANT_TPM)),
+            "weight": float(override.get("weight", 1.0)),
+        }
+
+    async def _charge(self, tenant_id: str, est_tokens: int) -> int:
+        """Count the request against per-minute limits, rejecting if over; returns the window minute"""
+        now = time.time()
+        minute = int(now // 60)
+        if RATE_LIMIT_BACKEND == "redis":
+            try:
+                client = await get_redis()
+                key = f"ratelimit:{tenant_id}:{minute}"
+                async with client.pipeline(transaction=True) as pipe:
+                    pipe.hincrby(key, "requests", 1)
+                    pipe.hincrby(key, "tokens", est_tokens)
+                    pipe.expire(key, 120)
+                    requests, tokens, _ = await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Rate limit counters unavailable, using local window: {str(e)}")
+                requests, tokens = self._local.add(tenant_id, minute, est_tokens)
+        else:
+            requests, tokens = self._local.add(tenant_id, minute, est_tokens)
+
+        limits = self.limits(tenant_id)
+        if requests > limits["rpm"] or tokens > limits["tpm"]:
+            self._reject(tenant_id)
+            raise AdmissionRejected(f"Rate limit exceeded for tenant {tenant_id}", 60 - now % 60)
+        return minute
+
+    async def _correct(self, tenant_id: str, minute: int, delta: int) -> None:
+        """Adjust a window's token count by the difference between estimated and actual usage"""
+        if not delta or minute != int(time.time() // 60):
+            # An expired window no longer limits anything
+            return
+        if RATE_LIMIT_BACKEND == "redis":
+            try:
+                client = await get_redis()
+                await client.hincrby(f"ratelimit:{tenant_id}:{minute}", "tokens", delta)
+                return
+            except Exception as e:
+                logger.warning(f"Rate limit counters unavailable, correcting local window: {str(e)}")
+        self._local.add(tenant_id, minute, delta, requests=0)
+
+    def _reject(self, tenant_id: str) -> None:
+        self.rejections[tenant_id] = self.rejections.get(tenant_id, 0) + 1
+
+    def _record_wait(self, tenant_id: str, waited: float) -> None:
+        LLM_QUEUE_WAIT_SECONDS.labels(tenant_id=tenant_id).observe(waited)
+        stats = self.wait_stats.setdefault(tenant_id, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["total_seconds"] += waited
+        stats["max_seconds"] = max(stats["max_seconds"], waited)
+
+    async def _acquire(self, tenant_id: str, est_tokens: int) -> None:
+        if self._active < self.concurrency and not self._heap:
+            self._active += 1
+            return
+
+        queued = self._tenant_queued.get(tenant_id, 0)
+        if queued >= self.tenant_max_queued or len(self._heap) >= self.max_queued:
+            self._reject(tenant_id)
+            raise AdmissionRejected(f"LLM queue full for tenant {tenant_id}", 1.0)
+
+        # Start-time fair queueing: cost scaled by the tenant's weight
+        start = max(self._virtual_time, self._tenant_finish.get(tenant_id, 0.0))
+        finish = start + est_tokens / self.limits(tenant_id)["weight"]
+        self._tenant_finish[tenant_id] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (start, next(self._seq), tenant_id, future))
+        self._tenant_queued[tenant_id] = queued + 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted as we were cancelled; hand it on
+                self._release()
+            raise
+        finally:
+            self._tenant_queued[tenant_id] -= 1
+
+    def _release(self) -> None:
+        while self._heap:
+            start, _, _, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+            self._virtual_time = max(self._virtual_time, start)
+            future.set_result(None)
+            return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: str, est_tokens: int) -> AsyncIterator[Callable[[int], Awaitable[None]]]:
+        """Admit, queue and hold one LLM slot for a tenant's request
+
+        Yields ``settle(actual_tokens)``, which replaces the estimate charged
+        to the tenant's token window with the tokens the call really used.
+        """
+        minute = await self._charge(tenant_id, est_tokens)
+        queued_at = time.monotonic()
+        await self._acquire(tenant_id, est_tokens)
+        self._record_wait(tenant_id, time.monotonic() - queued_at)
+
+        async def settle(actual_tokens: int) -> None:
+            await self._correct(tenant_id, minute, actual_tokens - est_tokens)
+
+        try:
+            yield settle
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queued": len(self._heap),
+            "concurrency": self.concurrency,
+            "queue_wait": {
+                tenant_id: {
+                    "count": s["count"],
+                    "avg_seconds": round(s["total_seconds"] / s["count"], 4),
+                    "max_seconds": round(s["max_seconds"], 4),
+                }
+                for tenant_id, s in self.wait_stats.items()
+            },
+            "rejections": dict(self.rejections),
+        }
+
+llm_scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, TENANT_MAX_QUEUED, SCHEDULER_MAX_QUEUED)
@@ -8,9 +8,12 @@ class AgentState(TypedDict, total=False):
     input: str
     system_prompt: str
     history: List[AnyMessage]
+    history_preloaded: bool  # transport already holds the session history (WebSocket)
     docs: List[str]  # from persistent memory retrieval (optional)
     response: str
     persist_memory: bool  # True => use pgvector pipeline
     notes_for_crm: Optional[str]
+    lead_id: Optional[str]  # lead that receives background CRM summaries
     identity: Dict[str, Any]
-    mission: Dict[str, Any]
\ No newline at end of file
+    mission: Dict[str, Any]
+    settings: Dict[str, Any]  # per-agent runtime settings (mission_json["runtime"])
\ No newline at end of file
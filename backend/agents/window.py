@@ -0,0 +1,114 @@
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.runnables import RunnableConfig
+from functools import lru_cache
+from typing import Any, Dict, List
+import os
+import logging
+import tiktoken
+from .memory import get_thread_history
+from ..deps import lc_llm
+
+logger = logging.getLogger(__name__)
+
+# Defaults for agents that do not set their own history budget
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+
+# Per-message overhead the chat format adds on top of the content tokens
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a website visitor and an assistant. "
+    "Keep names, contact details, stated needs and commitments. Reply with the summary only, "
+    "in at most 120 words.\n\nCurrent summary:\n{summary}\n\nNew messages:\n{messages}"
+)
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+@lru_cache(maxsize=50_000)
+def count_text_tokens(text: str) -> int:
+    """Token count for a piece of text, memoized on the text"""
+    return len(_encoding().encode(text))
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """Token count for a message, cached on its content so threads are not re-tokenized"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_text_tokens(content) + _MESSAGE_OVERHEAD_TOKENS
+
+def estimate_turn_tokens(system_prompt: str, user_input: str, history: List[BaseMessage],
+                         context: List[BaseMessage], settings: Dict[str, Any]) -> int:
+    """Token estimate for one turn, reserved against per-tenant token limits
+
+    Counts the prompt actually being sent (history capped at its window budget)
+    plus the reply's ``max_tokens``; the scheduler corrects the reservation
+    with the model's reported usage once the call returns.
+    """
+    history_tokens = sum(count_message_tokens(m) for m in history)
+    return (
+        count_text_tokens(system_prompt)
+        + count_text_tokens(user_input)
+        + min(history_tokens, history_settings(settings)["token_budget"])
+        + sum(count_message_tokens(m) for m in context)
+        + max_reply_tokens(settings)
+    )
+
+def max_reply_tokens(settings: Dict[str, Any]) -> int:
+    """Reply length cap from an agent's model settings"""
+    return int((settings.get("model") or {}).get("max_tokens") or os.getenv("MAX_TOKENS", "1024"))
+
+def history_settings(settings: Dict[str, Any]) -> Dict[str, int]:
+    """Resolve an agent's history budget from its runtime settings"""
+    return {
+        "token_budget": int(settings.get("history_token_budget", HISTORY_TOKEN_BUDGET)),
+        "keep_turns": int(settings.get("history_keep_turns", HISTORY_KEEP_TURNS)),
+    }
+
+async def _summarize(summary: str, messages: List[BaseMessage]) -> str:
+    """Fold new messages into the existing rolling summary"""
+    prompt = SUMMARY_PROMPT.format(
+        summary=summary or "(none)",
+        messages=get_buffer_string(messages, human_prefix="Visitor", ai_prefix="Assistant")
+    )
+    result = await lc_llm().ainvoke(prompt)
+    return result.content.strip()
+
+def make_history_window(token_budget: int, keep_turns: int):
+    """Build an async step that fits thread history into a token budget
+
+    If the full history fits it is passed through untouched. Otherwise the last
+    ``keep_turns`` turns are kept verbatim (fewer if they alone exceed the budget)
+    and everything older is folded into a rolling summary. Only messages not yet
+    covered by the stored summary are sent to the summarizer.
+    """
+
+    async def window(inputs: Dict[str, Any], config: RunnableConfig) -> List[BaseMessage]:
+        messages: List[BaseMessage] = inputs.get("history", [])
+        counts = [count_message_tokens(m) for m in messages]
+        if sum(counts) <= token_budget:
+            return messages
+
+        # Keep the newest turns that fit; everything before `cut` gets folded
+        cut = max(0, len(messages) - keep_turns * 2)
+        kept = sum(counts[cut:])
+        while cut < len(messages) and kept > token_budget:
+            kept -= counts[cut]
+            cut += 1
+
+        history = get_thread_history(config["configurable"]["session_id"])
+        summary, folded = await history.aget_summary()
+        if cut > folded:
+            summary = await _summarize(summary, messages[folded:cut])
+            await history.aset_summary(summary, cut)
+            logger.info(f"Folded {cut - folded} messages into rolling summary")
+
+        window_messages = messages[cut:]
+        if summary:
+            window_messages = [SystemMessage(f"Summary of the earlier conversation:\n{summary}")] + window_messages
+        return window_messages
+
+    return window
@@ -1,10 +1,21 @@
 import os
+import asyncio
 import logging
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from .routers import chat, admin, leads
-from .deps import get_db_pool
+from .routers import chat, chat_ws, admin, leads
+from .deps import get_db_pool, get_redis, close_db_pool, close_redis, close_llm_clients
+from .cache import listen_for_invalidations
+from .outbox import ghl_outbox_worker
+from .transcripts import transcript_writer
+from .migrations import migrate_on_startup
+from .repo import close_ghl_client
+from .blobstore import close_blob_store
+from .metrics import render_metrics
+from .agents.memory import memory_writer
+from .agents.crm_notes import crm_summarizer
 from contextlib import asynccontextmanager
 
 # Configure logging
@@ -18,13 +29,43 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Agentic Widget API...")
     
     # Initialize database pool
-    await get_db_pool()
+    pool = await get_db_pool()
     logger.info("Database pool initialized")
     
+    # Apply pending schema migrations (one replica at a time, under an advisory lock)
+    await migrate_on_startup(pool)
+    
+    # Deliver queued GoHighLevel pushes in the background
+    ghl_outbox_worker.start()
+    
+    # Create upcoming transcript partitions and drop expired ones
+    transcript_writer.start()
+    
+    # Keep this worker's caches coherent with admin updates made on other workers
+    invalidation_task = asyncio.create_task(listen_for_invalidations())
+    
     yield
     
     # Shutdown
     logger.info("Shutting down Agentic Widget API...")
+    invalidation_task.cancel()
+    
+    # Finish in-flight GHL pushes; unsent rows stay queued for the next start
+    await ghl_outbox_worker.stop()
+    await close_ghl_client()
+    
+    # Flush queued persistent memory writes, pending CRM summaries and transcripts
+    await memory_writer.close()
+    await crm_summarizer.close()
+    await transcript_writer.close()
+    
+    # Release pooled LLM connections and storage I/O threads
+    await close_llm_clients()
+    await close_blob_store()
+    
+    # Close shared connections last; everything above may still use them
+    await close_redis()
+    await close_db_pool()
 
 app = FastAPI(
     title="Agentic Widget API",
@@ -47,12 +88,69 @@ app.add_middleware(
 app.include_router(admin.router)
 app.include_router(leads.router)
 app.include_router(chat.router)
+app.include_router(chat_ws.router)
+
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+
+async def _probe(check) -> dict:
+    """Run one dependency round-trip, reporting latency or the failure"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout=HEALTH_PROBE_TIMEOUT)
+        return {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except Exception as e:
+        return {"status": "error", "error": str(e) or type(e).__name__}
+
+async def _check_db() -> None:
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.fetchval("SELECT 1")
+
+async def _check_redis() -> None:
+    client = await get_redis()
+    await client.ping()
 
 # Health check
 @app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    return {"status": "ok", "service": "agentic-widget-api"}
+async def health_check(response: Response):
+    """Health check with pool saturation and DB/Redis round-trip latency"""
+    db, redis_status = await asyncio.gather(_probe(_check_db), _probe(_check_redis))
+    
+    pool_stats = None
+    from .deps import _db_pool
+    if _db_pool is not None:
+        size, idle = _db_pool.get_size(), _db_pool.get_idle_size()
+        max_size = _db_pool.get_max_size()
+        pool_stats = {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "max": max_size,
+            "saturation": round((size - idle) / max_size, 3),
+        }
+    
+    # Redis is degraded-but-serving (history, caches and rate limits fall back); the DB is required
+    status = "ok"
+    if db["status"] != "ok":
+        status = "unavailable"
+        response.status_code = 503
+    elif redis_status["status"] != "ok":
+        status = "degraded"
+    
+    return {
+        "status": status,
+        "service": "agentic-widget-api",
+        "database": db,
+        "redis": redis_status,
+        "db_pool": pool_stats,
+    }
+
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 # Root endpoint
 @app.get("/")
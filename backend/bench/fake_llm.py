@@ -0,0 +1,72 @@
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from typing import Any, AsyncIterator, List, Optional
+import asyncio
+import hashlib
+import time
+
+_VOCABULARY = (
+    "happy to help with that our team can walk you through pricing plans and "
+    "book a quick demo whenever it suits you just share your email and we will "
+    "follow up with the details you need today"
+).split()
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline chat model with configurable latency and token streaming
+
+    The reply depends only on the last message, so runs are repeatable.
+    ``first_token_ms`` models time-to-first-token and ``token_ms`` the gap
+    between streamed tokens.
+    """
+
+    first_token_ms: float = 300.0
+    token_ms: float = 15.0
+    reply_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply_tokens(self, messages: List[BaseMessage]) -> List[str]:
+        seed = hashlib.sha256(str(messages[-1].content).encode("utf-8")).digest()
+        return [
+            _VOCABULARY[(seed[i % len(seed)] + i) % len(_VOCABULARY)] + " "
+            for i in range(self.reply_tokens)
+        ]
+
+    def _usage(self, messages: List[BaseMessage], tokens: List[str]) -> dict:
+        prompt = sum(len(str(m.content)) for m in messages) // 4
+        return {"input_tokens": prompt, "output_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._reply_tokens(messages)
+        time.sleep((self.first_token_ms + self.token_ms * len(tokens)) / 1000)
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._reply_tokens(messages)
+        await asyncio.sleep((self.first_token_ms + self.token_ms * len(tokens)) / 1000)
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._reply_tokens(messages)
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content=token,
+                usage_metadata=self._usage(messages, tokens) if last else None
+            ))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            if not last:
+                await asyncio.sleep(self.token_ms / 1000)
@@ -0,0 +1,150 @@
+from datetime import date, datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import uuid
+from ..database import CHAT_SUMMARY_MARKER, MESSAGE_COLUMNS, Database
+from ..repo import lead_to_contact
+
+class InMemoryDatabase(Database):
+    """Process-local stand-in for ``Database`` used by the benchmark harness
+
+    Mirrors the upsert semantics of the Postgres queries (agents unique on
+    (tenant_id, name), leads on (tenant_id, email)). ``latency_ms`` adds a
+    simulated round-trip to every call.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__(pool=None)
+        self.latency = latency_ms / 1000
+        self.tenants: Dict[str, Dict[str, Any]] = {}
+        self.agents: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.leads: Dict[str, Dict[str, Any]] = {}
+        self.lead_emails: Dict[Tuple[str, str], str] = {}
+        self.outbox: List[Dict[str, Any]] = []
+        self.messages: List[Tuple] = []
+
+    async def _roundtrip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    async def execute_migration(self, migration_sql: str) -> None:
+        await self._roundtrip()
+
+    async def ensure_tenant(self, tenant_id: str, name: str = None) -> Dict[str, Any]:
+        await self._roundtrip()
+        return self.tenants.setdefault(tenant_id, {"id": tenant_id, "name": name or f"Tenant {tenant_id}"})
+
+    async def get_agent(self, tenant_id: str, agent_name: str) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        agent = self.agents.get((tenant_id, agent_name))
+        return dict(agent) if agent else None
+
+    async def upsert_agent(self, tenant_id: str, agent_data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._roundtrip()
+        self.tenants.setdefault(tenant_id, {"id": tenant_id, "name": f"Tenant {tenant_id}"})
+        now = datetime.now(timezone.utc)
+        existing = self.agents.get((tenant_id, agent_data["name"]))
+        agent = {
+            "id": existing["id"] if existing else str(uuid.uuid4()),
+            "tenant_id": tenant_id,
+            "name": agent_data["name"],
+            "avatar_url": agent_data.get("avatar_url"),
+            "system_prompt": agent_data["system_prompt"],
+            "identity_json": agent_data["identity"] or {},
+            "mission_json": agent_data["mission"] or {},
+            "memory_mode": agent_data["memory_mode"],
+            "created_at": existing["created_at"] if existing else now,
+            "updated_at": now,
+        }
+        self.agents[(tenant_id, agent["name"])] = agent
+        return dict(agent)
+
+    def _upsert_lead(self, tenant_id: str, lead_data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        now = datetime.now(timezone.utc)
+        email = lead_data.get("email")
+        lead_id = self.lead_emails.get((tenant_id, email)) if email else None
+        created = lead_id is None
+        lead = self.leads.get(lead_id) if lead_id else {
+            "id": str(uuid.uuid4()), "tenant_id": tenant_id, "ghl_contact_id": None, "created_at": now
+        }
+        lead.update({
+            "first_name": lead_data.get("first_name"),
+            "last_name": lead_data.get("last_name"),
+            "email": email,
+            "phone": lead_data.get("phone"),
+            "notes": lead_data.get("notes"),
+            "updated_at": now,
+        })
+        self.leads[lead["id"]] = lead
+        if email:
+            self.lead_emails[(tenant_id, email)] = lead["id"]
+        return lead, created
+
+    async def upsert_lead(self, tenant_id: str, lead_data: Dict[str, Any],
+                          enqueue_ghl: bool = False) -> Dict[str, Any]:
+        await self._roundtrip()
+        lead, _ = self._upsert_lead(tenant_id, lead_data)
+        if enqueue_ghl:
+            self.outbox.append({"tenant_id": tenant_id, "lead_id": lead["id"], "payload": lead_to_contact(lead)})
+        return dict(lead)
+
+    async def bulk_upsert_leads(self, tenant_id: str, rows: List[Dict[str, Any]],
+                                enqueue_ghl: bool = False) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        results = []
+        for row in rows:
+            lead, created = self._upsert_lead(tenant_id, row)
+            results.append({"row_no": row["row_no"], "id": lead["id"], "status": "created" if created else "updated"})
+            if enqueue_ghl:
+                self.outbox.append({"tenant_id": tenant_id, "lead_id": lead["id"], "payload": lead_to_contact(lead)})
+        return results
+
+    async def update_lead_ghl_id(self, lead_id: str, ghl_contact_id: str) -> None:
+        await self._roundtrip()
+        self.leads[lead_id]["ghl_contact_id"] = ghl_contact_id
+
+    async def update_lead_summaries(self, summaries: List[Tuple[str, str, str]]) -> int:
+        await self._roundtrip()
+        updated = 0
+        for tenant_id, lead_id, summary in summaries:
+            lead = self.leads.get(lead_id)
+            if lead and lead["tenant_id"] == tenant_id:
+                kept = (lead["notes"] or "").split(CHAT_SUMMARY_MARKER)[0].rstrip()
+                lead["notes"] = "\n\n".join(filter(None, [kept, f"{CHAT_SUMMARY_MARKER} {summary}"]))
+                updated += 1
+        return updated
+
+    def _tenant_leads(self, tenant_id: str) -> List[Dict[str, Any]]:
+        leads = [lead for lead in self.leads.values() if lead["tenant_id"] == tenant_id]
+        return sorted(leads, key=lambda lead: (lead["created_at"], lead["id"]), reverse=True)
+
+    async def get_leads_page(self, tenant_id: str, limit: int,
+                             after: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        leads = self._tenant_leads(tenant_id)
+        if after is not None:
+            leads = [lead for lead in leads if (lead["created_at"], lead["id"]) < after]
+        return [dict(lead) for lead in leads[:limit]]
+
+    async def stream_leads(self, tenant_id: str, prefetch: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        await self._roundtrip()
+        for lead in self._tenant_leads(tenant_id):
+            yield dict(lead)
+
+    async def insert_messages(self, records: List[Tuple]) -> None:
+        await self._roundtrip()
+        self.messages.extend(records)
+
+    async def ensure_message_partitions(self, months: List[date]) -> None:
+        await self._roundtrip()
+
+    async def drop_message_partitions_before(self, month: date) -> List[str]:
+        await self._roundtrip()
+        return []
+
+    async def get_session_messages(self, tenant_id: str, session_id: str, limit: int,
+                                   agent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        rows = [dict(zip(MESSAGE_COLUMNS, record)) for record in self.messages]
+        rows = [r for r in rows if r["tenant_id"] == tenant_id and r["session_id"] == session_id
+                and (agent_id is None or r["agent_id"] == agent_id)]
+        return sorted(rows, key=lambda r: r["created_at"])[-limit:]
@@ -0,0 +1,223 @@
+"""Offline load test for the chat, lead and admin endpoints
+
+Runs in-process against the benchmark app (fake LLM, in-memory database)::
+
+    python -m backend.bench.run --concurrency 50 --requests 2000 --output bench.json
+
+or against a running worker (e.g. ``uvicorn backend.bench.server:app``)::
+
+    python -m backend.bench.run --base-url http://localhost:8001 --worker-pid <pid>
+
+Results (p50/p95/p99 latency, RPS, errors, worker RSS) are written as JSON;
+``--compare`` prints the change against a previous result file. In-process
+runs buffer streamed responses, so time-to-first-token is only meaningful
+with ``--base-url``.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import uuid
+import httpx
+
+TENANT_ID = "00000000-0000-0000-0000-0000000000be"
+AGENT_NAME = "Bench"
+OPENERS = [
+    "What are your prices?",
+    "How do I book a demo?",
+    "Do you offer a free trial?",
+    "Can I talk to someone on your team?",
+    "What products do you have?",
+]
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident set size of the worker process in MiB"""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid is None:
+        # ru_maxrss is KiB on Linux (peak, not current)
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def drive(name: str, total: int, concurrency: int,
+                request: Callable[[int], Awaitable[Optional[float]]]) -> Dict[str, Any]:
+    """Issue ``total`` requests with ``concurrency`` workers and summarize latency"""
+    latencies: List[float] = []
+    first_byte: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ttfb = await request(i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if ttfb is not None:
+                first_byte.append(ttfb)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if first_byte:
+        result["ttft_p50_ms"] = round(percentile(first_byte, 50) * 1000, 2)
+        result["ttft_p95_ms"] = round(percentile(first_byte, 95) * 1000, 2)
+    print(f"{name:12s} {json.dumps(result)}")
+    return result
+
+def agent_payload(prompt_suffix: str = "") -> Dict[str, Any]:
+    return {
+        "tenant_id": TENANT_ID,
+        "name": AGENT_NAME,
+        "system_prompt": "You are a helpful assistant for a benchmark tenant." + prompt_suffix,
+        "identity": {"brand": "Bench"},
+        "mission": {"mission": "Answer quickly"},
+        "memory_mode": "thread",
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=120)
+    else:
+        from .server import build_app
+        app = build_app(args.llm_first_token_ms, args.llm_token_ms, args.llm_reply_tokens, args.db_latency_ms)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+
+    sessions = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    scenarios: Dict[str, Any] = {}
+
+    async with client:
+        (await client.post("/api/v1/admin/agent", json=agent_payload())).raise_for_status()
+
+        async def chat(i: int) -> None:
+            response = await client.post("/api/v1/chat", json={
+                "tenant_id": TENANT_ID,
+                "agent_name": AGENT_NAME,
+                "session_id": sessions[i % len(sessions)],
+                "user_input": OPENERS[i % len(OPENERS)],
+            })
+            response.raise_for_status()
+
+        async def chat_stream(i: int) -> float:
+            started = time.perf_counter()
+            ttft = None
+            async with client.stream("POST", "/api/v1/chat/stream", json={
+                "tenant_id": TENANT_ID,
+                "agent_name": AGENT_NAME,
+                "session_id": sessions[i % len(sessions)],
+                "user_input": OPENERS[i % len(OPENERS)],
+            }) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if ttft is None and line.startswith("event: token"):
+                        ttft = time.perf_counter() - started
+                    if line.startswith("event: error"):
+                        raise RuntimeError("stream error event")
+            return ttft if ttft is not None else time.perf_counter() - started
+
+        async def leads(i: int) -> None:
+            response = await client.post("/api/v1/leads", json={
+                "tenant_id": TENANT_ID,
+                "first_name": f"Lead{i}",
+                "email": f"lead{i % max(1, args.sessions)}@bench.example",
+                "notes": "benchmark",
+                "push_to_ghl": False,
+            })
+            response.raise_for_status()
+
+        async def admin(i: int) -> None:
+            response = await client.post("/api/v1/admin/agent", json=agent_payload(f" Revision {i}."))
+            response.raise_for_status()
+
+        scenario_fns = {"chat": chat, "chat_stream": chat_stream, "leads": leads, "admin": admin}
+        for name in args.endpoints.split(","):
+            scenarios[name] = await drive(name, args.requests, args.concurrency, scenario_fns[name])
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "worker_rss_mb": rss_mb(args.worker_pid if args.base_url else None),
+        "scenarios": scenarios,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print per-scenario changes against a previous result file"""
+    print(f"\nvs {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before.get(key):
+                deltas.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"{name:12s} {'  '.join(deltas)}")
+    if current.get("worker_rss_mb") and baseline.get("worker_rss_mb"):
+        print(f"{'rss':12s} {current['worker_rss_mb'] - baseline['worker_rss_mb']:+.1f} MiB")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="chat,chat_stream,leads,admin",
+                        help="comma-separated scenarios: chat, chat_stream, leads, admin")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--sessions", type=int, default=100, help="distinct chat sessions / lead emails")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-token-ms", type=float, default=15.0)
+    parser.add_argument("--llm-reply-tokens", type=int, default=40)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--worker-pid", type=int, help="pid of the server worker, for RSS with --base-url")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nworker RSS: {results['worker_rss_mb']} MiB; results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Benchmark app with the model, database and Redis swapped for local fakes
+
+Serve it under uvicorn to load-test a real worker process::
+
+    uvicorn backend.bench.server:app --port 8001
+
+``BENCH_LLM_FIRST_TOKEN_MS``, ``BENCH_LLM_TOKEN_MS``, ``BENCH_LLM_REPLY_TOKENS``
+and ``BENCH_DB_LATENCY_MS`` tune the fakes.
+"""
+from contextlib import asynccontextmanager
+import os
+import tempfile
+
+# Keep every backend process-local; must be set before the app modules import
+os.environ.setdefault("HISTORY_BACKEND", "memory")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+os.environ.setdefault("IDEMPOTENCY_BACKEND", "memory")
+os.environ.setdefault("EMBEDDING_PROVIDER", "hash")
+os.environ.setdefault("STORAGE_ROOT", tempfile.mkdtemp(prefix="bench-storage-"))
+os.environ.setdefault("TENANT_RPM", "1000000000")
+os.environ.setdefault("TENANT_TPM", "1000000000000")
+os.environ.setdefault("TENANT_MAX_QUEUED", "100000")
+os.environ.setdefault("SCHEDULER_MAX_QUEUED", "100000")
+
+from fastapi import FastAPI
+from .fake_llm import FakeChatModel
+from .memory_db import InMemoryDatabase
+
+def build_app(first_token_ms: float = 300.0, token_ms: float = 15.0, reply_tokens: int = 40,
+              db_latency_ms: float = 0.0) -> FastAPI:
+    """Return the API app wired to a fake chat model and an in-memory database"""
+    from .. import app as app_module
+    from .. import cache
+    from ..agents import crm_notes, resilience, window
+    from .. import transcripts
+    from ..routers import admin, chat, chat_ws, leads
+
+    llm = FakeChatModel(first_token_ms=first_token_ms, token_ms=token_ms, reply_tokens=reply_tokens)
+    resilience.lc_llm = window.lc_llm = crm_notes.lc_llm = lambda *args, **kwargs: llm
+
+    db = InMemoryDatabase(latency_ms=db_latency_ms)
+
+    async def get_db_pool():
+        return None
+
+    for module in (admin, chat, chat_ws, leads, transcripts):
+        module.Database = lambda pool: db
+        module.get_db_pool = get_db_pool
+
+    async def no_redis():
+        raise ConnectionError("Redis is disabled in benchmark mode")
+    cache.get_redis = no_redis
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI):
+        yield
+
+    app_module.app.router.lifespan_context = lifespan
+    app_module.app.state.bench_db = db
+    return app_module.app
+
+app = build_app(
+    first_token_ms=float(os.getenv("BENCH_LLM_FIRST_TOKEN_MS", "300")),
+    token_ms=float(os.getenv("BENCH_LLM_TOKEN_MS", "15")),
+    reply_tokens=int(os.getenv("BENCH_LLM_REPLY_TOKENS", "40")),
+    db_latency_ms=float(os.getenv("BENCH_DB_LATENCY_MS", "0")),
+)
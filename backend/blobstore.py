@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import logging
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage"))
+STORAGE_IO_THREADS = int(os.getenv("STORAGE_IO_THREADS", "4"))
+BLOB_CACHE_MAX_ENTRIES = int(os.getenv("BLOB_CACHE_MAX_ENTRIES", "2000"))
+
+def canonical_json(obj: Any) -> bytes:
+    """Serialize so equal configs always produce identical bytes (and digests)"""
+    return json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+def blob_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class BlobStore:
+    """Interface for immutable content-addressed blobs plus small mutable refs
+
+    Blobs are keyed by the SHA-256 of their bytes, so they can be cached forever
+    and a put of existing content is a no-op. Refs are named pointers (e.g. an
+    agent's current identity/mission digests) that are replaced atomically.
+    """
+
+    async def put(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    async def get(self, digest: str) -> bytes:
+        raise NotImplementedError
+
+    async def put_ref(self, namespace: str, name: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def get_ref(self, namespace: str, name: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    async def put_json(self, obj: Any) -> str:
+        return await self.put(canonical_json(obj))
+
+    async def get_json(self, digest: str) -> Any:
+        return json.loads(await self.get(digest))
+
+def _safe_segment(segment: str) -> str:
+    """Path component for a caller-supplied name; anything unusual is hashed"""
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,128}", segment):
+        return segment
+    return hashlib.sha256(segment.encode("utf-8")).hexdigest()
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """Write to a temp file in the target directory, fsync, then rename over the target"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+class LocalBlobStore(BlobStore):
+    """Blobs under ``<root>/blobs/<aa>/<digest>``, refs under ``<root>/refs/<namespace>/<name>.json``
+
+    All filesystem calls run on a small dedicated thread pool, never on the
+    event loop. Blob contents and known digests are cached in-process, so
+    repeated saves of an unchanged config skip disk I/O entirely.
+    """
+
+    def __init__(self, root: str, io_threads: int):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="blobstore")
+        self._blobs = TTLCache("blobs", BLOB_CACHE_MAX_ENTRIES, float("inf"))
+        self._refs = TTLCache("blob_refs", BLOB_CACHE_MAX_ENTRIES, float("inf"))
+
+    async def _io(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _ref_path(self, namespace: str, name: str) -> str:
+        return os.path.join(self.root, "refs", _safe_segment(namespace), _safe_segment(name) + ".json")
+
+    def _write_blob(self, path: str, data: bytes) -> bool:
+        if os.path.exists(path):
+            return False
+        _atomic_write(path, data)
+        return True
+
+    async def put(self, data: bytes) -> str:
+        digest = blob_digest(data)
+        if self._blobs.get(digest) is None:
+            if await self._io(self._write_blob, self._blob_path(digest), data):
+                logger.info(f"Stored blob {digest[:12]} ({len(data)} bytes)")
+            self._blobs.set(digest, data)
+        return digest
+
+    async def get(self, digest: str) -> bytes:
+        data = self._blobs.get(digest)
+        if data is None:
+            data = await self._io(_read, self._blob_path(digest))
+            self._blobs.set(digest, data)
+        return data
+
+    async def put_ref(self, namespace: str, name: str, value: Dict[str, Any]) -> None:
+        if self._refs.get((namespace, name)) == value:
+            return
+        await self._io(_atomic_write, self._ref_path(namespace, name), canonical_json(value))
+        self._refs.set((namespace, name), value)
+
+    async def get_ref(self, namespace: str, name: str) -> Optional[Dict[str, Any]]:
+        value = self._refs.get((namespace, name))
+        if value is None:
+            try:
+                value = json.loads(await self._io(_read, self._ref_path(namespace, name)))
+            except FileNotFoundError:
+                return None
+            self._refs.set((namespace, name), value)
+        return value
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+_store: Optional[BlobStore] = None
+
+def get_blob_store() -> BlobStore:
+    """Get or create the configured blob store"""
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND != "local":
+            raise ValueError(f"Unsupported STORAGE_BACKEND: {STORAGE_BACKEND}")
+        _store = LocalBlobStore(STORAGE_ROOT, STORAGE_IO_THREADS)
+        logger.info(f"Blob store: {STORAGE_BACKEND} ({STORAGE_ROOT})")
+    return _store
+
+def set_blob_store(store: BlobStore) -> None:
+    """Override the blob store (tests, benchmarks, object storage)"""
+    global _store
+    _store = store
+
+async def close_blob_store() -> None:
+    """Release the blob store's I/O threads"""
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -0,0 +1,263 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import logging
+from .deps import get_redis
+from .agents.embeddings import get_embedding_provider
+
+logger = logging.getLogger(__name__)
+
+# Every cache instance, for stats reporting
+_registry: List[Any] = []
+
+class TTLCache:
+    """In-process LRU cache with per-entry expiry and single-flight loading
+
+    Concurrent misses for the same key share one in-flight load instead of
+    each hitting the backing store.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        _registry.append(self)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+        # A load already in flight may have read the old value; don't let it populate
+        self._inflight.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # Shielded so one cancelled caller doesn't abort the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+            if value is not None and self._inflight.get(key) is task:
+                self.set(key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+# Parsed agent configs keyed by (tenant_id, agent_name)
+AGENT_CACHE_TTL_SECONDS = float(os.getenv("AGENT_CACHE_TTL_SECONDS", "300"))
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1000"))
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+agent_cache = TTLCache("agent_config", AGENT_CACHE_MAX_ENTRIES, AGENT_CACHE_TTL_SECONDS)
+
+async def get_agent_cached(db, tenant_id: str, agent_name: str) -> Optional[Dict[str, Any]]:
+    """Get agent config through the cache, loading from the database on a miss"""
+    return await agent_cache.get_or_load(
+        (tenant_id, agent_name),
+        lambda: db.get_agent(tenant_id, agent_name)
+    )
+
+# Rendered system prompts keyed by (agent_id, content hash); edits change the hash
+compiled_prompt_cache = TTLCache(
+    "compiled_prompt", int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "1000")), float("inf")
+)
+
+def prompt_hash(*parts: Any) -> str:
+    """Stable content hash of a prompt and whatever else shapes the reply"""
+    content = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+def normalize_input(text: str) -> str:
+    """Canonical form of a user message for exact-match caching"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+# First-turn response cache (opt-in per agent via mission.runtime.response_cache)
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | redis
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_PER_AGENT = int(os.getenv("SEMANTIC_CACHE_MAX_PER_AGENT", "256"))
+
+class ResponseCache:
+    """Replies to opening messages keyed by (agent_id, prompt hash, normalized input)
+
+    Exact matches use the local LRU or Redis. Semantic mode additionally keeps
+    a bounded per-worker list of input embeddings per agent and returns the
+    reply of the nearest cached input above a cosine-similarity threshold.
+    Cache failures (Redis or embedding errors) are counted and treated as a
+    miss, so the turn falls through to the model.
+    """
+
+    def __init__(self, backend: str):
+        self.name = "response"
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._local = TTLCache("response_local", RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+        self._semantic: Dict[Tuple[str, str], "OrderedDict[str, Tuple[float, List[float], str]]"] = {}
+
+    def _key(self, agent_id: str, phash: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_input(text).encode("utf-8")).hexdigest()[:32]
+        return f"respcache:{agent_id}:{phash}:{digest}"
+
+    async def get(self, agent_id: str, phash: str, text: str, options: Dict[str, Any]) -> Optional[str]:
+        key = self._key(agent_id, phash, text)
+        try:
+            if self.backend == "redis":
+                client = await get_redis()
+                reply = await client.get(key)
+            else:
+                reply = self._local.get((agent_id, key))
+            if reply is None and options.get("semantic"):
+                reply = await self._semantic_get(agent_id, phash, text, float(options.get("semantic_threshold", 0.92)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache lookup failed; treating as a miss: {str(e)}")
+            reply = None
+        if reply is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return reply
+
+    async def set(self, agent_id: str, phash: str, text: str, reply: str, options: Dict[str, Any]) -> None:
+        key = self._key(agent_id, phash, text)
+        ttl = float(options.get("ttl_seconds", RESPONSE_CACHE_TTL_SECONDS))
+        try:
+            if self.backend == "redis":
+                client = await get_redis()
+                await client.set(key, reply, ex=int(ttl))
+            else:
+                self._local.set((agent_id, key), reply, ttl)
+            if options.get("semantic"):
+                await self._semantic_set(agent_id, phash, text, reply, ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache write failed: {str(e)}")
+
+    async def _semantic_get(self, agent_id: str, phash: str, text: str, threshold: float) -> Optional[str]:
+        entries = self._semantic.get((agent_id, phash))
+        if not entries:
+            return None
+        [query] = await get_embedding_provider().aembed([text])
+        now = time.monotonic()
+        best, best_score = None, threshold
+        for expires, vector, reply in entries.values():
+            if expires < now:
+                continue
+            score = sum(a * b for a, b in zip(query, vector))
+            if score >= best_score:
+                best, best_score = reply, score
+        return best
+
+    async def _semantic_set(self, agent_id: str, phash: str, text: str, reply: str, ttl: float) -> None:
+        [vector] = await get_embedding_provider().aembed([text])
+        entries = self._semantic.setdefault((agent_id, phash), OrderedDict())
+        entries[normalize_input(text)] = (time.monotonic() + ttl, vector, reply)
+        while len(entries) > SEMANTIC_CACHE_MAX_PER_AGENT:
+            entries.popitem(last=False)
+
+    def invalidate_agent(self, agent_id: str) -> None:
+        """Drop local entries for an agent; Redis entries are orphaned by the prompt hash"""
+        self._local.invalidate_where(lambda k: k[0] == agent_id)
+        for key in [k for k in self._semantic if k[0] == agent_id]:
+            del self._semantic[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_BACKEND)
+_registry.append(response_cache)
+
+def _apply_invalidation(message: Dict[str, Any]) -> None:
+    if message.get("kind") == "agent":
+        agent_cache.invalidate((message["tenant_id"], message["agent_name"]))
+        if message.get("agent_id"):
+            response_cache.invalidate_agent(message["agent_id"])
+            compiled_prompt_cache.invalidate_where(lambda k: k[0] == message["agent_id"])
+
+async def invalidate_agent(tenant_id: str, agent_name: str, agent_id: Optional[str] = None) -> None:
+    """Drop an agent's cached config and replies locally and tell other workers to do the same"""
+    message = {"kind": "agent", "tenant_id": tenant_id, "agent_name": agent_name, "agent_id": agent_id}
+    _apply_invalidation(message)
+    try:
+        client = await get_redis()
+        await client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+    except Exception as e:
+        # Other workers fall back to TTL expiry
+        logger.warning(f"Cache invalidation publish failed: {str(e)}")
+
+async def listen_for_invalidations() -> None:
+    """Apply invalidations published by other workers (run as a background task)"""
+    while True:
+        try:
+            client = await get_redis()
+            pubsub = client.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            logger.info("Subscribed to cache invalidation channel")
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _apply_invalidation(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener error: {str(e)}; retrying")
+            await asyncio.sleep(5)
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss counters for every process-local cache"""
+    return {cache.name: cache.stats() for cache in _registry}
@@ -1,146 +1,345 @@
 import asyncpg
 import os
 import logging
-from typing import Optional, Dict, Any, List
-import json
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+from datetime import date, datetime
+import re
 import uuid
+from .repo import lead_to_contact
+from .metrics import timed_acquire, timed_db
 
 logger = logging.getLogger(__name__)
 
+# Transcript rows as copied into the partitioned messages table (see transcripts.py)
+MESSAGE_COLUMNS = ["id", "tenant_id", "agent_id", "session_id", "lead_id", "role", "content", "created_at"]
+
+def message_partition_name(month: date) -> str:
+    return f"messages_p{month.year:04d}{month.month:02d}"
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+# Prefix of the background chat summary inside leads.notes
+CHAT_SUMMARY_MARKER = "[Chat summary]"
+
 class Database:
     """Direct PostgreSQL database operations using asyncpg"""
     
     def __init__(self, pool: asyncpg.Pool):
         self.pool = pool
     
+    @timed_db
     async def execute_migration(self, migration_sql: str) -> None:
         """Execute database migration"""
-        async with self.pool.acquire() as conn:
+        async with timed_acquire(self.pool) as conn:
             await conn.execute(migration_sql)
             logger.info("Migration executed successfully")
     
+    @timed_db
     async def ensure_tenant(self, tenant_id: str, name: str = None) -> Dict[str, Any]:
         """Ensure tenant exists"""
-        async with self.pool.acquire() as conn:
+        async with timed_acquire(self.pool) as conn:
+            return dict(await self._ensure_tenant(conn, tenant_id, name))
+    
+    @staticmethod
+    async def _ensure_tenant(conn: asyncpg.Connection, tenant_id: str, name: str = None) -> asyncpg.Record:
+        # DO NOTHING avoids rewriting (and locking) the row on every agent upsert;
+        # RETURNING is then empty for an existing tenant, so read it instead
+        tenant = await conn.fetchrow("""
+            INSERT INTO tenants (id, name) VALUES ($1, $2)
+            ON CONFLICT (id) DO NOTHING
+            RETURNING *
+        """, tenant_id, name or f"Tenant {tenant_id}")
+        if tenant is None:
             tenant = await conn.fetchrow("SELECT * FROM tenants WHERE id = $1", tenant_id)
-            if not tenant:
-                await conn.execute(
-                    "INSERT INTO tenants (id, name) VALUES ($1, $2)",
-                    tenant_id, name or f"Tenant {tenant_id}"
-                )
-                tenant = await conn.fetchrow("SELECT * FROM tenants WHERE id = $1", tenant_id)
-            return dict(tenant)
+        return tenant
+    
+    @staticmethod
+    def _agent_dict(agent: asyncpg.Record) -> Dict[str, Any]:
+        result = dict(agent)
+        result["identity_json"] = result["identity_json"] or {}
+        result["mission_json"] = result["mission_json"] or {}
+        return result
     
+    @timed_db
     async def get_agent(self, tenant_id: str, agent_name: str) -> Optional[Dict[str, Any]]:
         """Get agent by tenant and name"""
-        async with self.pool.acquire() as conn:
+        async with timed_acquire(self.pool) as conn:
             agent = await conn.fetchrow(
                 "SELECT * FROM agents WHERE tenant_id = $1 AND name = $2",
                 tenant_id, agent_name
             )
-            if agent:
-                result = dict(agent)
-                # Parse JSON fields
-                result["identity_json"] = json.loads(agent["identity_json"]) if agent["identity_json"] else {}
-                result["mission_json"] = json.loads(agent["mission_json"]) if agent["mission_json"] else {}
-                return result
-            return None
+            return self._agent_dict(agent) if agent else None
     
+    @timed_db
     async def upsert_agent(self, tenant_id: str, agent_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create or update agent"""
-        async with self.pool.acquire() as conn:
-            # Ensure tenant exists
-            await self.ensure_tenant(tenant_id)
-            
-            existing = await conn.fetchrow(
-                "SELECT * FROM agents WHERE tenant_id = $1 AND name = $2",
-                tenant_id, agent_data["name"]
-            )
+        """Create or update agent (relies on UNIQUE (tenant_id, name))"""
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            await self._ensure_tenant(conn, tenant_id)
+            agent = await conn.fetchrow("""
+                INSERT INTO agents (id, tenant_id, name, avatar_url, system_prompt,
+                                    identity_json, mission_json, memory_mode)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                ON CONFLICT (tenant_id, name) DO UPDATE
+                SET avatar_url = EXCLUDED.avatar_url, system_prompt = EXCLUDED.system_prompt,
+                    identity_json = EXCLUDED.identity_json, mission_json = EXCLUDED.mission_json,
+                    memory_mode = EXCLUDED.memory_mode, updated_at = NOW()
+                RETURNING *
+            """, str(uuid.uuid4()), tenant_id, agent_data["name"], agent_data.get("avatar_url"),
+                agent_data["system_prompt"], agent_data["identity"],
+                agent_data["mission"], agent_data["memory_mode"])
+            return self._agent_dict(agent)
+    
+    @timed_db
+    async def upsert_lead(self, tenant_id: str, lead_data: Dict[str, Any],
+                          enqueue_ghl: bool = False) -> Dict[str, Any]:
+        """Create or update lead, optionally enqueueing a GHL push in the same transaction
+        
+        Leads are matched on UNIQUE (tenant_id, email); leads without an email
+        never conflict and are always inserted.
+        """
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            lead = await conn.fetchrow("""
+                INSERT INTO leads (id, tenant_id, first_name, last_name, email, phone, notes)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (tenant_id, email) DO UPDATE
+                SET first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name,
+                    phone = EXCLUDED.phone, notes = EXCLUDED.notes, updated_at = NOW()
+                RETURNING *
+            """, str(uuid.uuid4()), tenant_id,
+                lead_data.get("first_name"), lead_data.get("last_name"),
+                lead_data.get("email"), lead_data.get("phone"), lead_data.get("notes"))
             
-            if existing:
-                # Update
+            if enqueue_ghl:
                 await conn.execute("""
-                    UPDATE agents 
-                    SET avatar_url = $3, system_prompt = $4, identity_json = $5, 
-                        mission_json = $6, memory_mode = $7, updated_at = NOW()
-                    WHERE tenant_id = $1 AND name = $2
-                """, tenant_id, agent_data["name"], agent_data.get("avatar_url"),
-                    agent_data["system_prompt"], json.dumps(agent_data["identity"]),
-                    json.dumps(agent_data["mission"]), agent_data["memory_mode"])
-                
-                agent = await conn.fetchrow(
-                    "SELECT * FROM agents WHERE tenant_id = $1 AND name = $2",
-                    tenant_id, agent_data["name"]
-                )
-            else:
-                # Create
-                agent_id = str(uuid.uuid4())
-                await conn.execute("""
-                    INSERT INTO agents (id, tenant_id, name, avatar_url, system_prompt, 
-                                      identity_json, mission_json, memory_mode)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                """, agent_id, tenant_id, agent_data["name"], agent_data.get("avatar_url"),
-                    agent_data["system_prompt"], json.dumps(agent_data["identity"]),
-                    json.dumps(agent_data["mission"]), agent_data["memory_mode"])
-                
-                agent = await conn.fetchrow("SELECT * FROM agents WHERE id = $1", agent_id)
-            
-            result = dict(agent)
-            result["identity_json"] = json.loads(agent["identity_json"]) if agent["identity_json"] else {}
-            result["mission_json"] = json.loads(agent["mission_json"]) if agent["mission_json"] else {}
-            return result
-    
-    async def upsert_lead(self, tenant_id: str, lead_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create or update lead"""
-        async with self.pool.acquire() as conn:
-            email = lead_data.get("email")
+                    INSERT INTO ghl_outbox (tenant_id, lead_id, payload)
+                    VALUES ($1, $2, $3)
+                """, tenant_id, str(lead["id"]), lead_to_contact(lead))
             
-            # Find existing by email
-            lead = None
-            if email:
-                lead = await conn.fetchrow(
-                    "SELECT * FROM leads WHERE tenant_id = $1 AND email = $2",
-                    tenant_id, email
-                )
+            return dict(lead)
+    
+    @timed_db
+    async def bulk_upsert_leads(self, tenant_id: str, rows: List[Dict[str, Any]],
+                                enqueue_ghl: bool = False) -> List[Dict[str, Any]]:
+        """Upsert a batch of validated leads with one COPY and one set-based merge
+        
+        Each row carries a ``row_no``. Rows sharing an email within the batch are
+        collapsed so the last one wins. Returns ``{row_no, id, status}`` per row,
+        where status is ``created``, ``updated`` or ``merged`` (superseded by a
+        later row in the same batch).
+        """
+        columns = ["row_no", "id", "first_name", "last_name", "email", "phone", "notes"]
+        records = [
+            (row["row_no"], str(uuid.uuid4()), row.get("first_name"), row.get("last_name"),
+             row.get("email"), row.get("phone"), row.get("notes"))
+            for row in rows
+        ]
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE lead_stage (
+                    row_no INT, id TEXT, first_name TEXT, last_name TEXT,
+                    email TEXT, phone TEXT, notes TEXT
+                ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table("lead_stage", records=records, columns=columns)
+            merged = await conn.fetch("""
+                INSERT INTO leads (id, tenant_id, first_name, last_name, email, phone, notes)
+                SELECT id, $1, first_name, last_name, email, phone, notes
+                FROM (
+                    SELECT DISTINCT ON (COALESCE(email, id)) *
+                    FROM lead_stage
+                    ORDER BY COALESCE(email, id), row_no DESC
+                ) latest
+                ON CONFLICT (tenant_id, email) DO UPDATE
+                SET first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name,
+                    phone = EXCLUDED.phone, notes = EXCLUDED.notes, updated_at = NOW()
+                RETURNING *, (xmax = 0) AS inserted
+            """, tenant_id)
             
-            if not lead:
-                # Create
-                lead_id = str(uuid.uuid4())
+            if enqueue_ghl and merged:
                 await conn.execute("""
-                    INSERT INTO leads (id, tenant_id, first_name, last_name, email, phone, notes)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
-                """, lead_id, tenant_id, 
-                    lead_data.get("first_name"), lead_data.get("last_name"),
-                    lead_data.get("email"), lead_data.get("phone"), lead_data.get("notes"))
-                
-                lead = await conn.fetchrow("SELECT * FROM leads WHERE id = $1", lead_id)
+                    INSERT INTO ghl_outbox (tenant_id, lead_id, payload)
+                    SELECT $1, lead_id, payload FROM unnest($2::text[], $3::jsonb[]) AS t(lead_id, payload)
+                """, tenant_id, [str(lead["id"]) for lead in merged],
+                    [lead_to_contact(lead) for lead in merged])
+        
+        return self._bulk_results(records, merged)
+    
+    @staticmethod
+    def _bulk_results(records: List[Tuple], merged: List[Any]) -> List[Dict[str, Any]]:
+        """Map each staged row to the lead it became; earlier rows sharing an email are ``merged``"""
+        by_email = {lead["email"]: lead for lead in merged if lead["email"] is not None}
+        by_id = {str(lead["id"]): lead for lead in merged}
+        winners = {record[4]: record[0] for record in records if record[4] is not None}
+        results = []
+        for row_no, staged_id, _, _, email, _, _ in records:
+            lead = by_id[staged_id] if email is None else by_email[email]
+            if email is not None and winners[email] != row_no:
+                status = "merged"
             else:
-                # Update
-                await conn.execute("""
-                    UPDATE leads 
-                    SET first_name = $3, last_name = $4, email = $5, phone = $6, notes = $7, updated_at = NOW()
-                    WHERE id = $1 AND tenant_id = $2
-                """, lead["id"], tenant_id,
-                    lead_data.get("first_name"), lead_data.get("last_name"),
-                    lead_data.get("email"), lead_data.get("phone"), lead_data.get("notes"))
-                
-                lead = await conn.fetchrow("SELECT * FROM leads WHERE id = $1", lead["id"])
-            
-            return dict(lead)
+                status = "created" if lead["inserted"] else "updated"
+            results.append({"row_no": row_no, "id": str(lead["id"]), "status": status})
+        return results
     
+    @timed_db
     async def update_lead_ghl_id(self, lead_id: str, ghl_contact_id: str) -> None:
         """Update lead with GHL contact ID"""
-        async with self.pool.acquire() as conn:
+        async with timed_acquire(self.pool) as conn:
             await conn.execute(
                 "UPDATE leads SET ghl_contact_id = $1 WHERE id = $2",
                 ghl_contact_id, lead_id
             )
     
-    async def get_leads_by_tenant(self, tenant_id: str) -> List[Dict[str, Any]]:
-        """Get all leads for tenant"""
-        async with self.pool.acquire() as conn:
-            leads = await conn.fetch(
-                "SELECT * FROM leads WHERE tenant_id = $1 ORDER BY created_at DESC",
-                tenant_id
+    @timed_db
+    async def update_lead_summaries(self, summaries: List[Tuple[str, str, str]]) -> int:
+        """Write chat summaries into lead notes for many ``(tenant_id, lead_id, summary)`` at once
+        
+        The summary replaces any earlier one after ``CHAT_SUMMARY_MARKER``;
+        notes entered before the marker are kept.
+        """
+        async with timed_acquire(self.pool) as conn:
+            status = await conn.execute("""
+                UPDATE leads l
+                SET notes = concat_ws(E'\\n\\n',
+                        NULLIF(rtrim(split_part(COALESCE(l.notes, ''), $4, 1)), ''),
+                        $4 || ' ' || v.summary),
+                    updated_at = NOW()
+                FROM unnest($1::text[], $2::text[], $3::text[]) AS v(tenant_id, lead_id, summary)
+                WHERE l.tenant_id = v.tenant_id AND l.id = v.lead_id
+            """, [s[0] for s in summaries], [s[1] for s in summaries], [s[2] for s in summaries],
+                CHAT_SUMMARY_MARKER)
+            return int(status.split()[-1])
+    
+    @timed_db
+    async def insert_messages(self, records: List[Tuple]) -> None:
+        """Append transcript rows ``(id, tenant_id, agent_id, session_id, lead_id, role, content, created_at)`` with COPY"""
+        async with timed_acquire(self.pool) as conn:
+            await conn.copy_records_to_table("messages", records=records, columns=MESSAGE_COLUMNS)
+    
+    @timed_db
+    async def ensure_message_partitions(self, months: List[date]) -> None:
+        """Create the monthly ``messages`` partitions covering the given months"""
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            # Serialize with other workers; IF NOT EXISTS alone races on concurrent creates
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('messages_partitions'))")
+            for month in months:
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {message_partition_name(month)}
+                    PARTITION OF messages
+                    FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+                """)
+    
+    @timed_db
+    async def drop_message_partitions_before(self, month: date) -> List[str]:
+        """Drop whole monthly ``messages`` partitions that end on or before ``month``"""
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('messages_partitions'))")
+            names = await conn.fetch("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'messages'::regclass
+            """)
+            cutoff = message_partition_name(month)
+            dropped = sorted(r["relname"] for r in names
+                             if re.fullmatch(r"messages_p\d{6}", r["relname"]) and r["relname"] < cutoff)
+            for name in dropped:
+                await conn.execute(f"DROP TABLE {name}")
+            return dropped
+    
+    @timed_db
+    async def get_session_messages(self, tenant_id: str, session_id: str, limit: int,
+                                   agent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent transcript messages of a session, oldest first"""
+        async with timed_acquire(self.pool) as conn:
+            rows = await conn.fetch("""
+                SELECT * FROM (
+                    SELECT * FROM messages
+                    WHERE tenant_id = $1 AND session_id = $2 AND ($3::text IS NULL OR agent_id = $3)
+                    ORDER BY created_at DESC
+                    LIMIT $4
+                ) recent ORDER BY created_at
+            """, tenant_id, session_id, agent_id, limit)
+            return [dict(row) for row in rows]
+    
+    @timed_db
+    async def get_leads_page(self, tenant_id: str, limit: int,
+                             after: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        """Get one page of leads, newest first, keyset-paginated on (created_at, id)"""
+        async with timed_acquire(self.pool) as conn:
+            if after is None:
+                leads = await conn.fetch("""
+                    SELECT * FROM leads WHERE tenant_id = $1
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT $2
+                """, tenant_id, limit)
+            else:
+                leads = await conn.fetch("""
+                    SELECT * FROM leads
+                    WHERE tenant_id = $1 AND (created_at, id) < ($2, $3)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT $4
+                """, tenant_id, after[0], after[1], limit)
+            return [dict(lead) for lead in leads]
+    
+    async def stream_leads(self, tenant_id: str, prefetch: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream every lead for a tenant through a server-side cursor in constant memory"""
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            async for lead in conn.cursor(
+                "SELECT * FROM leads WHERE tenant_id = $1 ORDER BY created_at DESC, id DESC",
+                tenant_id, prefetch=prefetch
+            ):
+                yield dict(lead)
+    
+    @timed_db
+    async def claim_ghl_outbox(self, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """Claim due outbox rows; the lease hides them from other workers until it expires"""
+        async with timed_acquire(self.pool) as conn:
+            rows = await conn.fetch("""
+                UPDATE ghl_outbox
+                SET attempts = attempts + 1,
+                    next_attempt_at = NOW() + make_interval(secs => $2)
+                WHERE id IN (
+                    SELECT id FROM ghl_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, tenant_id, lead_id, payload, attempts
+            """, limit, lease_seconds)
+            return [dict(row) for row in rows]
+    
+    @timed_db
+    async def complete_ghl_outbox(self, outbox_id: int, lead_id: str, ghl_contact_id: str) -> None:
+        """Record a successful push on the lead and mark the outbox row done"""
+        async with timed_acquire(self.pool) as conn, conn.transaction():
+            await conn.execute(
+                "UPDATE leads SET ghl_contact_id = $1 WHERE id = $2",
+                ghl_contact_id, lead_id
             )
-            return [dict(lead) for lead in leads]
\ No newline at end of file
+            await conn.execute(
+                "UPDATE ghl_outbox SET status = 'done', processed_at = NOW(), last_error = NULL WHERE id = $1",
+                outbox_id
+            )
+    
+    @timed_db
+    async def retry_ghl_outbox(self, outbox_id: int, delay_seconds: float, error: Optional[str],
+                               count_attempt: bool = True) -> None:
+        """Reschedule an outbox row after a failure or rate-limit deferral"""
+        async with timed_acquire(self.pool) as conn:
+            await conn.execute("""
+                UPDATE ghl_outbox
+                SET next_attempt_at = NOW() + make_interval(secs => $2),
+                    last_error = COALESCE($3, last_error),
+                    attempts = attempts - CASE WHEN $4 THEN 0 ELSE 1 END
+                WHERE id = $1
+            """, outbox_id, delay_seconds, error, count_attempt)
+    
+    @timed_db
+    async def dead_letter_ghl_outbox(self, outbox_id: int, error: str) -> None:
+        """Move an outbox row to the dead-letter state after exhausting retries"""
+        async with timed_acquire(self.pool) as conn:
+            await conn.execute(
+                "UPDATE ghl_outbox SET status = 'dead', last_error = $2, processed_at = NOW() WHERE id = $1",
+                outbox_id, error
+            )
\ No newline at end of file
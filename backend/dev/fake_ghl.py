@@ -0,0 +1,37 @@
+"""Local GoHighLevel stand-in for tests and benchmarks
+
+Run with ``uvicorn backend.dev.fake_ghl:app --port 8099`` and point
+``GHL_API_BASE`` at ``http://localhost:8099``. ``FAKE_GHL_LATENCY_MS`` adds
+response latency and ``FAKE_GHL_FAILURE_RATE`` returns 503s at random, to
+exercise the outbox worker's retries.
+"""
+from fastapi import FastAPI, HTTPException, Request
+import asyncio
+import os
+import random
+import uuid
+
+app = FastAPI(title="Fake GoHighLevel")
+
+LATENCY_MS = float(os.getenv("FAKE_GHL_LATENCY_MS", "50"))
+FAILURE_RATE = float(os.getenv("FAKE_GHL_FAILURE_RATE", "0"))
+
+contacts = {}
+
+@app.post("/contacts/")
+async def create_contact(request: Request):
+    """Upsert a contact by email (or phone) and return its id"""
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if random.random() < FAILURE_RATE:
+        raise HTTPException(503, "Simulated outage")
+    contact = await request.json()
+    key = contact.get("email") or contact.get("phone")
+    if not key:
+        raise HTTPException(422, "email or phone required")
+    contact_id = contacts.setdefault(key, {"id": str(uuid.uuid4()), **contact})["id"]
+    return {"contact": {"id": contact_id, **contact}}
+
+@app.get("/contacts/")
+async def list_contacts():
+    """List every contact received so far"""
+    return {"contacts": list(contacts.values())}
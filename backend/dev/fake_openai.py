@@ -0,0 +1,111 @@
+"""Local OpenAI-compatible chat completions stand-in for latency testing
+
+Run one per simulated deployment, e.g. a slow primary and a fast fallback::
+
+    FAKE_LLM_FIRST_TOKEN_MS=4000 uvicorn backend.dev.fake_openai:app --port 8101
+    FAKE_LLM_FIRST_TOKEN_MS=200 uvicorn backend.dev.fake_openai:app --port 8102
+
+and set ``OPENAI_BASE_URL=http://localhost:8101/v1`` and
+``LLM_FALLBACK_BASE_URL=http://localhost:8102/v1``. ``FAKE_LLM_TOKEN_MS`` sets
+the gap between streamed tokens, ``FAKE_LLM_SLOW_RATE`` delays that fraction
+of requests by ``FAKE_LLM_SLOW_MS`` before the first token, and
+``FAKE_LLM_FAILURE_RATE`` returns 503s at random.
+"""
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+app = FastAPI(title="Fake OpenAI")
+
+FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))
+TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "15"))
+REPLY_TOKENS = int(os.getenv("FAKE_LLM_REPLY_TOKENS", "30"))
+SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+SLOW_MS = float(os.getenv("FAKE_LLM_SLOW_MS", "10000"))
+FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+
+stats = {"requests": 0, "failures": 0, "slow": 0, "cancelled": 0}
+
+def _reply_tokens(model: str) -> list:
+    return [f"[{model}]"] + ["token"] * (REPLY_TOKENS - 1)
+
+def _usage(body: dict, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Chat completion with simulated time-to-first-token, streaming or not"""
+    body = await request.json()
+    stats["requests"] += 1
+    if random.random() < FAILURE_RATE:
+        stats["failures"] += 1
+        raise HTTPException(503, "Simulated outage")
+
+    delay = FIRST_TOKEN_MS
+    if random.random() < SLOW_RATE:
+        stats["slow"] += 1
+        delay += SLOW_MS
+    model = body.get("model", "fake")
+    tokens = _reply_tokens(model)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await asyncio.sleep((delay + TOKEN_MS * len(tokens)) / 1000)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body, len(tokens)),
+        }
+
+    def chunk(delta: dict, finish_reason=None, usage=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+        }
+        if usage is not None:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def stream():
+        try:
+            await asyncio.sleep(delay / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                yield chunk({"content": token if i == 0 else " " + token})
+                await asyncio.sleep(TOKEN_MS / 1000)
+            yield chunk({}, finish_reason="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk({}, usage=_usage(body, len(tokens)))
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:
+            # Client hung up, e.g. the losing side of a hedged request
+            stats["cancelled"] += 1
+            raise
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/stats")
+async def get_stats():
+    """Request, failure, slow and cancelled counts since start"""
+    return stats
@@ -0,0 +1,164 @@
+from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import json
+import os
+import time
+import logging
+from .cache import TTLCache
+from .deps import get_redis
+from .metrics import IDEMPOTENT_REPLAYS
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")  # memory | redis
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# How long a duplicate waits on another worker's in-flight original, and how long that claim lives
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyError(Exception):
+    """Idempotency key cannot be honoured; ``status`` is the HTTP status to return"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """Hash of the request body, so a reused key with a different body is rejected"""
+    content = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    """Results of keyed requests, with in-flight coalescing of duplicates
+
+    ``claim`` returns the stored result for a key that already completed, waits
+    for an in-flight original and returns its result, or returns None when the
+    caller is the first and must run the request and then call ``complete``
+    (or ``release`` on failure, so a retry can run it again). Duplicates on
+    this worker await the original's future; with the Redis backend a pending
+    marker coalesces duplicates across workers and results are shared.
+    A local claim lives ``IDEMPOTENCY_WAIT_SECONDS`` like the Redis marker, so
+    an owner that never completes or releases cannot block its key for good.
+    """
+
+    def __init__(self, backend: str, ttl_seconds: float, max_entries: int):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._done = TTLCache("idempotency", max_entries, ttl_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._claimed_at: Dict[str, float] = {}
+
+    @staticmethod
+    def _key(scope: str, tenant_id: str, key: str) -> str:
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise IdempotencyError(f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters", 400)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return f"idem:{scope}:{tenant_id}:{digest}"
+
+    @staticmethod
+    def _check(entry: Dict[str, Any], fingerprint: str) -> None:
+        if entry["fingerprint"] != fingerprint:
+            raise IdempotencyError("Idempotency-Key was already used with a different request body", 422)
+
+    async def claim(self, scope: str, tenant_id: str, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        ikey = self._key(scope, tenant_id, key)
+        future = self._inflight.get(ikey)
+        if future is not None and time.monotonic() - self._claimed_at[ikey] >= IDEMPOTENCY_WAIT_SECONDS:
+            logger.warning(f"Expiring abandoned idempotency claim {ikey}")
+            self._settle(ikey, error=IdempotencyError("The original request with this Idempotency-Key was abandoned; retry", 409))
+            future = None
+        if future is not None:
+            self._check({"fingerprint": self._fingerprints[ikey]}, fingerprint)
+            IDEMPOTENT_REPLAYS.labels(scope=scope, source="inflight").inc()
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                raise IdempotencyError("A request with this Idempotency-Key is still in progress", 409)
+
+        entry = self._done.get(ikey)
+        if entry is None and self.backend == "redis":
+            try:
+                entry = await self._claim_shared(ikey, fingerprint)
+            except IdempotencyError:
+                raise
+            except Exception as e:
+                # Degrade to per-worker de-duplication rather than failing the request
+                logger.warning(f"Idempotency claim in Redis failed: {str(e)}")
+        if entry is not None:
+            self._check(entry, fingerprint)
+            IDEMPOTENT_REPLAYS.labels(scope=scope, source="stored").inc()
+            return entry["result"]
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting; don't warn about an unretrieved failure
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[ikey] = future
+        self._fingerprints[ikey] = fingerprint
+        self._claimed_at[ikey] = time.monotonic()
+        return None
+
+    def _settle(self, ikey: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[BaseException] = None) -> str:
+        """Drop the local claim and hand its outcome to waiting duplicates; returns its fingerprint"""
+        self._claimed_at.pop(ikey, None)
+        fingerprint = self._fingerprints.pop(ikey, "")
+        future = self._inflight.pop(ikey, None)
+        if future is not None and not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        return fingerprint
+
+    async def _claim_shared(self, ikey: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Set a pending marker in Redis, or wait for the worker holding it to finish"""
+        client = await get_redis()
+        pending = json.dumps({"status": "pending", "fingerprint": fingerprint})
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            if await client.set(ikey, pending, nx=True, ex=int(IDEMPOTENCY_WAIT_SECONDS)):
+                return None
+            raw = await client.get(ikey)
+            if raw is None:
+                # The original failed and released its claim
+                raise IdempotencyError("The original request with this Idempotency-Key failed; retry", 409)
+            entry = json.loads(raw)
+            self._check(entry, fingerprint)
+            if entry["status"] == "done":
+                self._done.set(ikey, entry)
+                return entry
+            if time.monotonic() >= deadline:
+                raise IdempotencyError("A request with this Idempotency-Key is still in progress", 409)
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def complete(self, scope: str, tenant_id: str, key: str, result: Dict[str, Any]) -> None:
+        """Store the original's result and hand it to waiting duplicates"""
+        ikey = self._key(scope, tenant_id, key)
+        entry = {"status": "done", "fingerprint": self._settle(ikey, result=result), "result": result}
+        self._done.set(ikey, entry)
+        if self.backend == "redis":
+            try:
+                client = await get_redis()
+                await client.set(ikey, json.dumps(entry, ensure_ascii=False), ex=int(self.ttl_seconds))
+            except Exception as e:
+                # Other workers will re-run a retry once the pending marker expires
+                logger.warning(f"Idempotency result write failed: {str(e)}")
+
+    async def release(self, scope: str, tenant_id: str, key: str, error: BaseException) -> None:
+        """Drop the claim after a failure; waiting duplicates receive the same error"""
+        ikey = self._key(scope, tenant_id, key)
+        if not isinstance(error, Exception):
+            error = IdempotencyError("The original request with this Idempotency-Key was cancelled; retry", 409)
+        self._settle(ikey, error=error)
+        if self.backend == "redis":
+            try:
+                client = await get_redis()
+                await client.delete(ikey)
+            except Exception as e:
+                logger.warning(f"Idempotency claim release failed: {str(e)}")
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_BACKEND, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
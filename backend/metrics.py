@@ -0,0 +1,159 @@
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+import os
+import time
+import logging
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Optional OpenTelemetry tracing; spans are no-ops unless enabled and installed
+_tracer = None
+if os.getenv("OTEL_ENABLED", "false").lower() == "true":
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("agentic-widget-api")
+    except ImportError:
+        logger.warning("OTEL_ENABLED is set but opentelemetry is not installed; tracing disabled")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+GRAPH_NODE_SECONDS = Histogram(
+    "chat_graph_node_seconds", "Chat graph node latency", ["node"], buckets=_LATENCY_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Database method latency", ["method"], buckets=_LATENCY_BUCKETS
+)
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_seconds", "Time waiting to check out a pool connection", buckets=_LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens", "LLM tokens consumed", ["tenant_id", "agent_id", "kind"]
+)
+LLM_ROUTE_REQUESTS = Counter(
+    "llm_route_requests", "Reply model calls by route (primary/fallback) and outcome", ["route", "outcome"]
+)
+IDEMPOTENT_REPLAYS = Counter(
+    "idempotent_replays", "Duplicate requests answered from their Idempotency-Key", ["scope", "source"]
+)
+TRANSCRIPT_DROPPED = Counter(
+    "transcript_messages_dropped", "Transcript messages lost (queue full or write retries exhausted)", ["reason"]
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds", "Wait for an LLM slot", ["tenant_id"], buckets=_LATENCY_BUCKETS
+)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """OpenTelemetry span when tracing is enabled, otherwise nothing"""
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+def instrument_node(name: str, node: Callable) -> Callable:
+    """Wrap an async graph node with a latency histogram and a trace span"""
+    histogram = GRAPH_NODE_SECONDS.labels(node=name)
+
+    @wraps(node)
+    async def wrapper(state, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(f"graph.{name}", tenant_id=state.get("tenant_id", ""), agent_id=str(state.get("agent_id", ""))):
+                return await node(state, *args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+def timed_db(method: Callable) -> Callable:
+    """Record latency of a Database coroutine method"""
+    histogram = DB_QUERY_SECONDS.labels(method=method.__name__)
+
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(f"db.{method.__name__}"):
+                return await method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+@asynccontextmanager
+async def timed_acquire(pool) -> AsyncIterator[Any]:
+    """Check out a pool connection, recording how long the checkout waited"""
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - started)
+        yield conn
+
+def record_llm_usage(tenant_id: str, agent_id: str, usage: Optional[Dict[str, Any]]) -> None:
+    """Count prompt/completion tokens reported by the model"""
+    if not usage:
+        return
+    LLM_TOKENS.labels(tenant_id, agent_id, "prompt").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(tenant_id, agent_id, "completion").inc(usage.get("output_tokens", 0))
+
+class _StateCollector:
+    """Scrape-time gauges for pool utilization, cache hit ratios, LLM slots and sockets
+
+    Read only when /metrics is scraped, so they cost nothing on the hot path.
+    """
+
+    def describe(self):
+        # Without this, registering calls collect() at import time, whose imports
+        # reach back into modules still being initialized
+        return []
+
+    def collect(self):
+        from .deps import _db_pool
+        from .cache import cache_stats
+        from .agents.scheduler import llm_scheduler
+        from .agents.resilience import breaker_states
+        from .routers.chat_ws import open_connections, WS_MAX_CONNECTIONS
+
+        pool = GaugeMetricFamily("db_pool_connections", "Database pool connections", labels=["state"])
+        if _db_pool is not None:
+            size, idle = _db_pool.get_size(), _db_pool.get_idle_size()
+            pool.add_metric(["max"], _db_pool.get_max_size())
+            pool.add_metric(["open"], size)
+            pool.add_metric(["in_use"], size - idle)
+        yield pool
+
+        ratio = GaugeMetricFamily("cache_hit_ratio", "Cache hit ratio", labels=["cache"])
+        for name, stats in cache_stats().items():
+            ratio.add_metric([name], stats["hit_ratio"])
+        yield ratio
+
+        scheduler = llm_scheduler.stats()
+        slots = GaugeMetricFamily("llm_slots", "LLM scheduler slots", labels=["state"])
+        slots.add_metric(["active"], scheduler["active"])
+        slots.add_metric(["queued"], scheduler["queued"])
+        slots.add_metric(["capacity"], scheduler["concurrency"])
+        yield slots
+
+        circuits = GaugeMetricFamily("llm_circuit_open", "Model route circuit open (1) or half-open (0.5)", labels=["route"])
+        for route, state in breaker_states().items():
+            circuits.add_metric([route], {"closed": 0, "half_open": 0.5, "open": 1}[state])
+        yield circuits
+
+        sockets = GaugeMetricFamily("ws_connections", "Widget WebSocket connections", labels=["state"])
+        sockets.add_metric(["open"], open_connections())
+        sockets.add_metric(["capacity"], WS_MAX_CONNECTIONS)
+        yield sockets
+
+REGISTRY.register(_StateCollector())
+
+def render_metrics() -> tuple:
+    """Serialize metrics for a scrape; aggregates across workers in multiprocess mode"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,274 @@
+"""Versioned schema migrations and a query-plan check for the hot-path queries
+
+Migrations run at startup from the app lifespan. They can also be applied, or
+the plans checked, from the command line::
+
+    python -m backend.migrations            # apply pending migrations
+    python -m backend.migrations --check    # fail if any Database query plans a sequential scan
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import logging
+import asyncpg
+from .agents.embeddings import EMBEDDING_DIM
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_ENABLED = os.getenv("MIGRATIONS_ENABLED", "true").lower() == "true"
+# Run the EXPLAIN check at startup too and refuse to start on a sequential scan
+MIGRATIONS_CHECK_PLANS = os.getenv("MIGRATIONS_CHECK_PLANS", "false").lower() == "true"
+MIGRATION_LOCK_KEY = "agentic_widget_schema_migrations"
+
+# (version, name, sql). Applied migrations are never edited; add a new version instead.
+# Every statement is idempotent so databases created before versioning adopt them cleanly.
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "base_schema", """
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS tenants (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS agents (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL REFERENCES tenants (id),
+    name TEXT NOT NULL,
+    avatar_url TEXT,
+    system_prompt TEXT NOT NULL,
+    identity_json JSONB NOT NULL DEFAULT '{}'::jsonb,
+    mission_json JSONB NOT NULL DEFAULT '{}'::jsonb,
+    memory_mode TEXT NOT NULL DEFAULT 'thread' CHECK (memory_mode IN ('thread', 'persistent')),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+-- get_agent / upsert_agent (ON CONFLICT (tenant_id, name))
+CREATE UNIQUE INDEX IF NOT EXISTS agents_tenant_id_name_key ON agents (tenant_id, name);
+
+-- Leads arrive from the public widget, so tenants are not enforced by a foreign key
+CREATE TABLE IF NOT EXISTS leads (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    phone TEXT,
+    notes TEXT,
+    ghl_contact_id TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+-- upsert_lead / bulk_upsert_leads (ON CONFLICT (tenant_id, email)); NULL emails never conflict
+CREATE UNIQUE INDEX IF NOT EXISTS leads_tenant_id_email_key ON leads (tenant_id, email);
+-- get_leads_page / stream_leads keyset order
+CREATE INDEX IF NOT EXISTS leads_tenant_id_created_at_id_idx ON leads (tenant_id, created_at DESC, id DESC);
+"""),
+    (2, "agent_memory", f"""
+CREATE TABLE IF NOT EXISTS agent_memory (
+    id UUID PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+    embedding vector({EMBEDDING_DIM}) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS agent_memory_tenant_agent_idx ON agent_memory (tenant_id, agent_id);
+CREATE INDEX IF NOT EXISTS agent_memory_embedding_hnsw_idx
+    ON agent_memory USING hnsw (embedding vector_cosine_ops);
+"""),
+    (3, "ghl_outbox", """
+CREATE TABLE IF NOT EXISTS ghl_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    lead_id TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS ghl_outbox_due_idx
+    ON ghl_outbox (next_attempt_at) WHERE status = 'pending';
+"""),
+    # Append-only conversation log, range-partitioned by month so retention is a
+    # partition drop; transcripts.py creates and drops the monthly partitions
+    (4, "messages", """
+CREATE TABLE IF NOT EXISTS messages (
+    id UUID NOT NULL,
+    tenant_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    lead_id TEXT,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (created_at);
+CREATE INDEX IF NOT EXISTS messages_tenant_session_created_at_idx
+    ON messages (tenant_id, session_id, created_at);
+"""),
+]
+
+SCHEMA_MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+def _checksum(sql: str) -> str:
+    return hashlib.sha256(sql.strip().encode("utf-8")).hexdigest()
+
+async def run_migrations(pool: asyncpg.Pool) -> List[int]:
+    """Apply pending migrations in order, each in its own transaction
+
+    A session advisory lock makes concurrent replicas wait while one of them
+    migrates; the others then find nothing left to do. Returns the versions
+    applied by this call.
+    """
+    applied_now: List[int] = []
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock(hashtext($1))", MIGRATION_LOCK_KEY)
+        try:
+            await conn.execute(SCHEMA_MIGRATIONS_DDL)
+            applied = {
+                row["version"]: row["checksum"]
+                for row in await conn.fetch("SELECT version, checksum FROM schema_migrations")
+            }
+            for version, name, sql in MIGRATIONS:
+                checksum = _checksum(sql)
+                if version in applied:
+                    if applied[version] != checksum:
+                        logger.warning(f"Migration {version} ({name}) differs from the applied version")
+                    continue
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                        version, name, checksum
+                    )
+                applied_now.append(version)
+                logger.info(f"Applied migration {version} ({name})")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", MIGRATION_LOCK_KEY)
+    if not applied_now:
+        logger.info("Database schema is up to date")
+    return applied_now
+
+# Statements issued by Database (and the memory/outbox/transcript modules) that read
+# or update existing rows, with representative parameters. Plain INSERTs and COPY
+# are left out; their ON CONFLICT targets are the unique indexes above.
+_vector = "[" + ",".join(["0"] * EMBEDDING_DIM) + "]"
+PLAN_CHECKS: List[Tuple[str, str, Tuple[Any, ...]]] = [
+    ("get_agent", "SELECT * FROM agents WHERE tenant_id = $1 AND name = $2", ("t", "a")),
+    ("get_leads_page", """
+        SELECT * FROM leads WHERE tenant_id = $1
+        ORDER BY created_at DESC, id DESC LIMIT $2
+    """, ("t", 100)),
+    ("get_leads_page (after cursor)", """
+        SELECT * FROM leads
+        WHERE tenant_id = $1 AND (created_at, id) < ($2::timestamptz, $3)
+        ORDER BY created_at DESC, id DESC LIMIT $4
+    """, ("t", datetime(2024, 1, 1, tzinfo=timezone.utc), "x", 100)),
+    ("stream_leads", "SELECT * FROM leads WHERE tenant_id = $1 ORDER BY created_at DESC, id DESC", ("t",)),
+    ("update_lead_ghl_id", "UPDATE leads SET ghl_contact_id = $1 WHERE id = $2", ("c", "l")),
+    ("update_lead_summaries", """
+        UPDATE leads l SET notes = v.summary
+        FROM unnest($1::text[], $2::text[], $3::text[]) AS v(tenant_id, lead_id, summary)
+        WHERE l.tenant_id = v.tenant_id AND l.id = v.lead_id
+    """, (["t"], ["l"], ["s"])),
+    ("claim_ghl_outbox", """
+        UPDATE ghl_outbox SET attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM ghl_outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY next_attempt_at LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (50,)),
+    ("complete/retry/dead_letter_ghl_outbox", "UPDATE ghl_outbox SET status = 'done' WHERE id = $1", (1,)),
+    ("retrieve_persistent_memory", """
+        SELECT content FROM agent_memory
+        WHERE tenant_id = $1 AND agent_id = $2
+        ORDER BY embedding <=> $3::vector LIMIT $4
+    """, ("t", "a", _vector, 5)),
+    ("get_session_messages", """
+        SELECT * FROM messages
+        WHERE tenant_id = $1 AND session_id = $2 AND ($3::text IS NULL OR agent_id = $3)
+        ORDER BY created_at DESC LIMIT $4
+    """, ("t", "s", None, 200)),
+]
+
+def _seq_scans(plan: Dict[str, Any]) -> List[str]:
+    """Relations read by Seq Scan nodes anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    found = [plan.get("Relation Name", "?")] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+async def check_query_plans(pool: asyncpg.Pool) -> Dict[str, List[str]]:
+    """EXPLAIN every hot-path query with sequential scans disabled
+
+    Disabling seqscans makes the planner use an index whenever one can serve
+    the query, so a Seq Scan left in the plan means no usable index exists
+    (tiny development tables would otherwise always plan a seqscan). Returns
+    the offending queries and relations; empty means every query is indexed.
+    """
+    failures: Dict[str, List[str]] = {}
+    async with pool.acquire() as conn:
+        for name, sql, args in PLAN_CHECKS:
+            tx = conn.transaction()
+            await tx.start()
+            try:
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+            finally:
+                await tx.rollback()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scans = _seq_scans(plan[0]["Plan"])
+            if scans:
+                failures[name] = scans
+                logger.error(f"Sequential scan in {name}: {', '.join(scans)}")
+    return failures
+
+async def migrate_on_startup(pool: asyncpg.Pool) -> None:
+    """Lifespan hook: apply migrations and optionally enforce the plan check"""
+    if not MIGRATIONS_ENABLED:
+        logger.info("Schema migrations disabled (MIGRATIONS_ENABLED=false)")
+        return
+    await run_migrations(pool)
+    if MIGRATIONS_CHECK_PLANS:
+        failures = await check_query_plans(pool)
+        if failures:
+            raise RuntimeError(f"Queries without a usable index: {', '.join(failures)}")
+
+async def _main(check: bool) -> int:
+    from .deps import get_db_pool, close_db_pool
+    pool = await get_db_pool()
+    try:
+        await run_migrations(pool)
+        if check:
+            failures = await check_query_plans(pool)
+            print("Query plan check: " + ("FAILED" if failures else "ok"))
+            return 1 if failures else 0
+        return 0
+    finally:
+        await close_db_pool()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="EXPLAIN hot-path queries and fail on a sequential scan")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(parser.parse_args().check)))
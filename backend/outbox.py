@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import time
+import logging
+from typing import Any, Dict, Optional, Set
+from .database import Database
+from .deps import get_db_pool
+from .repo import GHLError, push_to_ghl
+
+logger = logging.getLogger(__name__)
+
+GHL_OUTBOX_CONCURRENCY = int(os.getenv("GHL_OUTBOX_CONCURRENCY", "8"))
+GHL_OUTBOX_BATCH_SIZE = int(os.getenv("GHL_OUTBOX_BATCH_SIZE", "50"))
+GHL_OUTBOX_POLL_SECONDS = float(os.getenv("GHL_OUTBOX_POLL_SECONDS", "2"))
+GHL_OUTBOX_LEASE_SECONDS = float(os.getenv("GHL_OUTBOX_LEASE_SECONDS", "60"))
+GHL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("GHL_OUTBOX_MAX_ATTEMPTS", "8"))
+GHL_TENANT_RATE_PER_MINUTE = float(os.getenv("GHL_TENANT_RATE_PER_MINUTE", "60"))
+
+class TokenBucket:
+    """Simple token bucket; ``take`` returns seconds to wait, 0 when a token was taken"""
+
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, amount: float = 1.0) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+def backoff_seconds(attempt: int, base: float = 2.0, cap: float = 900.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class GHLOutboxWorker:
+    """Drains the ghl_outbox table with bounded concurrency and per-tenant rate limits
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED plus a lease, so several workers
+    or replicas can run side by side. Failed pushes back off exponentially and
+    are dead-lettered after ``max_attempts``.
+    """
+
+    def __init__(self, concurrency: int, batch_size: int, poll_seconds: float,
+                 lease_seconds: float, max_attempts: int, tenant_rate_per_minute: float):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.tenant_rate = tenant_rate_per_minute / 60.0
+        self.concurrency = concurrency
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("GHL outbox worker started")
+
+    def notify(self) -> None:
+        """Wake the worker early after new rows were enqueued"""
+        self._wake.set()
+
+    async def stop(self) -> None:
+        """Stop claiming new rows and wait for in-flight pushes to finish"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        logger.info("GHL outbox worker stopped")
+
+    async def _run(self) -> None:
+        db = Database(await get_db_pool())
+        while True:
+            try:
+                # Only claim what we can start right away; the rest stays visible to other workers
+                free = self.concurrency - len(self._inflight)
+                rows = await db.claim_ghl_outbox(min(free, self.batch_size), self.lease_seconds) if free else []
+            except Exception as e:
+                logger.error(f"GHL outbox claim failed: {str(e)}")
+                rows = []
+
+            for row in rows:
+                task = asyncio.create_task(self._process(db, row))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+            if len(rows) < self.batch_size:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _bucket(self, tenant_id: str) -> TokenBucket:
+        bucket = self._buckets.get(tenant_id)
+        if bucket is None:
+            bucket = TokenBucket(self.tenant_rate, max(1.0, self.tenant_rate * 10))
+            self._buckets[tenant_id] = bucket
+        return bucket
+
+    async def _process(self, db: Database, row: Dict[str, Any]) -> None:
+        try:
+            wait = self._bucket(row["tenant_id"]).take()
+            if wait:
+                # Over the tenant's rate: defer without spending an attempt
+                await db.retry_ghl_outbox(row["id"], wait, None, count_attempt=False)
+                return
+
+            try:
+                contact_id = await push_to_ghl(row["payload"])
+            except GHLError as e:
+                if not e.retryable or row["attempts"] >= self.max_attempts:
+                    await db.dead_letter_ghl_outbox(row["id"], str(e))
+                    logger.error(f"GHL push for lead {row['lead_id']} dead-lettered: {str(e)}")
+                else:
+                    delay = e.retry_after or backoff_seconds(row["attempts"])
+                    await db.retry_ghl_outbox(row["id"], delay, str(e))
+                    logger.warning(f"GHL push for lead {row['lead_id']} failed, retrying in {delay:.1f}s: {str(e)}")
+                return
+
+            await db.complete_ghl_outbox(row["id"], row["lead_id"], contact_id)
+            logger.info(f"Lead {row['lead_id']} pushed to GHL: {contact_id}")
+        except Exception as e:
+            # Leave the row leased; it becomes due again when the lease expires
+            logger.error(f"GHL outbox processing failed for row {row['id']}: {str(e)}")
+        finally:
+            self._wake.set()
+
+ghl_outbox_worker = GHLOutboxWorker(
+    GHL_OUTBOX_CONCURRENCY,
+    GHL_OUTBOX_BATCH_SIZE,
+    GHL_OUTBOX_POLL_SECONDS,
+    GHL_OUTBOX_LEASE_SECONDS,
+    GHL_OUTBOX_MAX_ATTEMPTS,
+    GHL_TENANT_RATE_PER_MINUTE,
+)
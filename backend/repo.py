@@ -0,0 +1,67 @@
+import os
+import logging
+from typing import Any, Dict, Mapping, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GHL_API_BASE = os.getenv("GHL_API_BASE", "https://rest.gohighlevel.com/v1")
+
+class GHLError(Exception):
+    """GoHighLevel request failed; ``retryable`` is False for permanent client errors"""
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+def lead_to_contact(lead: Mapping[str, Any]) -> Dict[str, Any]:
+    """Map a lead row to a GoHighLevel contact payload"""
+    contact = {
+        "firstName": lead.get("first_name"),
+        "lastName": lead.get("last_name"),
+        "email": lead.get("email"),
+        "phone": lead.get("phone"),
+        "source": "chat-widget",
+        "tags": ["chat-widget"],
+    }
+    return {k: v for k, v in contact.items() if v is not None}
+
+_ghl_client: Optional[httpx.AsyncClient] = None
+
+def get_ghl_client() -> httpx.AsyncClient:
+    """Get or create the pooled GoHighLevel HTTP client"""
+    global _ghl_client
+    if _ghl_client is None:
+        _ghl_client = httpx.AsyncClient(
+            base_url=GHL_API_BASE,
+            headers={"Authorization": f"Bearer {os.getenv('GHL_API_KEY', '')}"},
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+        )
+    return _ghl_client
+
+async def close_ghl_client() -> None:
+    """Close the pooled GoHighLevel HTTP client"""
+    global _ghl_client
+    if _ghl_client is not None:
+        await _ghl_client.aclose()
+        _ghl_client = None
+
+async def push_to_ghl(contact: Dict[str, Any]) -> str:
+    """Create or update a GoHighLevel contact and return its id"""
+    try:
+        response = await get_ghl_client().post("/contacts/", json=contact)
+    except httpx.HTTPError as e:
+        raise GHLError(f"GHL request failed: {str(e)}")
+
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get("Retry-After")
+        raise GHLError(
+            f"GHL returned {response.status_code}",
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+    if response.status_code >= 400:
+        raise GHLError(f"GHL rejected contact ({response.status_code}): {response.text[:200]}", retryable=False)
+
+    return response.json()["contact"]["id"]
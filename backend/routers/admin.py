@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
 from ..database import Database
 from ..deps import get_db_pool
-import os
-import json
+from ..cache import invalidate_agent, cache_stats
+from ..agents.scheduler import llm_scheduler
+from ..agents.prompts import compile_system_prompt
+from ..blobstore import get_blob_store
+import asyncio
 from datetime import datetime
 from typing import Dict, Any, Optional
 
@@ -20,36 +23,32 @@ class AgentBuilderReq(BaseModel):
 
 @router.post("/agent")
 async def create_or_update_agent(req: AgentBuilderReq):
-    """Create or update agent configuration with file storage"""
+    """Create or update agent configuration with content-addressed file storage"""
     
     # Get database instance
     pool = await get_db_pool()
     db = Database(pool)
+    store = get_blob_store()
     
-    # Create storage directory for tenant
-    storage_path = os.path.abspath(os.path.join(
-        os.path.dirname(__file__), "..", "storage", req.tenant_id
-    ))
-    os.makedirs(storage_path, exist_ok=True)
-    
-    # Write identity.json and mission.json files
+    # Store identity and mission blobs; unchanged content is not rewritten, and
+    # blobs left unreferenced by a failed upsert are harmless
     try:
-        with open(os.path.join(storage_path, "identity.json"), "w", encoding="utf-8") as f:
-            json.dump(req.identity, f, indent=2, ensure_ascii=False)
-        
-        with open(os.path.join(storage_path, "mission.json"), "w", encoding="utf-8") as f:
-            json.dump(req.mission, f, indent=2, ensure_ascii=False)
-            
+        identity_ref, mission_ref = await asyncio.gather(
+            store.put_json(req.identity), store.put_json(req.mission)
+        )
     except Exception as e:
         raise HTTPException(500, f"Failed to write agent files: {str(e)}")
     
-    # Upsert agent in database
+    # Upsert agent in database, then point the agent at its current blobs
     agent = await db.upsert_agent(req.tenant_id, req.model_dump())
+    storage = {"identity": identity_ref, "mission": mission_ref}
+    await store.put_ref(req.tenant_id, str(agent["id"]), storage)
+    await invalidate_agent(req.tenant_id, req.name, str(agent["id"]))
     
     return {
         "agent_id": agent["id"],
         "updated_at": datetime.utcnow().isoformat(),
-        "storage_path": storage_path,
+        "storage": storage,
         "memory_mode": agent["memory_mode"]
     }
 
@@ -70,5 +69,44 @@ async def get_agent(tenant_id: str, agent_name: str):
         "system_prompt": agent["system_prompt"],
         "identity": agent["identity_json"],
         "mission": agent["mission_json"],
-        "memory_mode": agent["memory_mode"]
-    }
\ No newline at end of file
+        "memory_mode": agent["memory_mode"],
+        "compiled_system_prompt": compile_system_prompt(
+            agent["id"], agent["system_prompt"], agent["identity_json"], agent["mission_json"]
+        )
+    }
+
+@router.get("/transcript/{tenant_id}/{session_id}")
+async def get_transcript(
+    tenant_id: str,
+    session_id: str,
+    agent_id: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=5000)
+):
+    """Get the logged messages of a chat session, oldest first"""
+    pool = await get_db_pool()
+    db = Database(pool)
+    messages = await db.get_session_messages(tenant_id, session_id, limit, agent_id)
+    return {
+        "session_id": session_id,
+        "messages": [
+            {
+                "id": str(m["id"]),
+                "agent_id": m["agent_id"],
+                "lead_id": m["lead_id"],
+                "role": m["role"],
+                "content": m["content"],
+                "created_at": m["created_at"].isoformat(),
+            }
+            for m in messages
+        ]
+    }
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss counters for this worker's in-process caches"""
+    return cache_stats()
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Get this worker's LLM slot usage, per-tenant queue wait times and rejections"""
+    return llm_scheduler.stats()
\ No newline at end of file
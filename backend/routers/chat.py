@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from ..database import Database
 from ..deps import get_db_pool
-from ..agents.graph import compile_graph
+from ..cache import get_agent_cached
+from ..agents.graph import compile_graph, REPLY_TAG
 from ..agents.state import AgentState
-from typing import Optional
+from ..agents.scheduler import AdmissionRejected
+from ..idempotency import idempotency_store, request_fingerprint, IdempotencyError
+from typing import Optional, Dict, Any, Tuple, AsyncIterator
 import json
 import logging
 
@@ -20,6 +25,7 @@ class ChatIn(BaseModel):
     agent_name: str = Field(..., description="Agent name")
     session_id: str = Field(..., description="Client session ID")
     user_input: str = Field(..., max_length=1000, description="User message")
+    lead_id: Optional[str] = Field(None, description="Captured lead whose notes receive the conversation summary")
 
 class ChatOut(BaseModel):
     reply: str
@@ -27,20 +33,8 @@ class ChatOut(BaseModel):
     agent_id: str
     session_id: str
 
-@router.post("", response_model=ChatOut)
-async def chat(req: ChatIn):
-    """Process chat message through LangGraph agent"""
-    
-    # Get database instance
-    pool = await get_db_pool()
-    db = Database(pool)
-    
-    # Get agent for tenant
-    agent = await db.get_agent(req.tenant_id, req.agent_name)
-    if not agent:
-        raise HTTPException(404, f"Agent '{req.agent_name}' not found for tenant {req.tenant_id}")
-    
-    # Prepare agent state
+def _agent_state(req: ChatIn, agent: Dict[str, Any]) -> Tuple[AgentState, Dict[str, Any]]:
+    """Build the initial graph state and run config for a resolved agent"""
     state: AgentState = {
         "tenant_id": req.tenant_id,
         "agent_id": agent["id"],
@@ -48,29 +42,195 @@ async def chat(req: ChatIn):
         "input": req.user_input,
         "system_prompt": agent["system_prompt"],
         "persist_memory": agent["memory_mode"] == "persistent",
+        "lead_id": req.lead_id,
         "identity": agent["identity_json"],
         "mission": agent["mission_json"],
-        "history": [],  # Handled by RunnableWithMessageHistory
+        "settings": agent["mission_json"].get("runtime", {}),
+        "history": [],  # Loaded by the graph
         "docs": []
     }
+    config = {
+        "configurable": {
+            "session_id": f"{req.tenant_id}:{agent['id']}:{req.session_id}"
+        }
+    }
+    return state, config
+
+async def _build_state(req: ChatIn) -> Tuple[Dict[str, Any], AgentState, Dict[str, Any]]:
+    """Resolve the agent and build the initial graph state and run config"""
+    
+    # Get database instance
+    pool = await get_db_pool()
+    db = Database(pool)
+    
+    # Get agent for tenant
+    agent = await get_agent_cached(db, req.tenant_id, req.agent_name)
+    if not agent:
+        raise HTTPException(404, f"Agent '{req.agent_name}' not found for tenant {req.tenant_id}")
     
+    state, config = _agent_state(req, agent)
+    return agent, state, config
+
+async def _graph_events(state: AgentState, config: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+    """Run the graph, yielding ``("token", text)`` for reply tokens and finally ``("result", state)``"""
+    result: Dict[str, Any] = {}
+    async for event in graph.astream_events(state, config=config, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream" and REPLY_TAG in event.get("tags", []):
+            token = event["data"]["chunk"].content
+            if token:
+                yield "token", token
+        elif kind == "on_chain_end" and event["name"] == "LangGraph":
+            result = event["data"].get("output") or {}
+    yield "result", result
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a single Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _chat_error(req: ChatIn, e: Exception) -> HTTPException:
+    """Map a chat failure to the HTTP error returned to the client"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AdmissionRejected):
+        logger.warning(f"Chat rejected for tenant {req.tenant_id}: {str(e)}")
+        return HTTPException(429, str(e), headers={"Retry-After": str(max(1, int(e.retry_after)))})
+    logger.error(f"Chat processing failed: {str(e)}")
+    return HTTPException(500, f"Chat processing failed: {str(e)}")
+
+async def _claim(req: ChatIn, idempotency_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Reply of an earlier or in-flight request with the same key, or None to run this one"""
+    if idempotency_key is None:
+        return None
     try:
+        return await idempotency_store.claim(
+            "chat", req.tenant_id, idempotency_key, request_fingerprint(req.model_dump())
+        )
+    except IdempotencyError as e:
+        raise HTTPException(e.status, str(e))
+
+@router.post("", response_model=ChatOut)
+async def chat(
+    req: ChatIn,
+    idempotency_key: Optional[str] = Header(None, description="Client message ID; retries with the same key return the original reply")
+):
+    """Process chat message through LangGraph agent"""
+    replay = await _claim(req, idempotency_key)
+    if replay is not None:
+        return ChatOut(**replay)
+    
+    try:
+        agent, state, config = await _build_state(req)
+        
         # Run the graph
-        result = graph.invoke(state, config={
-            "configurable": {
-                "session_id": f"{req.tenant_id}:{agent['id']}:{req.session_id}"
-            }
-        })
+        result = await graph.ainvoke(state, config=config)
         
         logger.info(f"Chat processed for session {req.session_id}")
         
-        return ChatOut(
+        out = ChatOut(
             reply=result["response"],
             notes_for_crm=result.get("notes_for_crm"),
             agent_id=agent["id"],
             session_id=req.session_id
         )
         
-    except Exception as e:
-        logger.error(f"Chat processing failed: {str(e)}")
-        raise HTTPException(500, f"Chat processing failed: {str(e)}")
\ No newline at end of file
+    except BaseException as e:
+        error = _chat_error(req, e) if isinstance(e, Exception) else e
+        if idempotency_key is not None:
+            await idempotency_store.release("chat", req.tenant_id, idempotency_key, error)
+        if error is e:
+            raise
+        raise error
+    
+    if idempotency_key is not None:
+        await idempotency_store.complete("chat", req.tenant_id, idempotency_key, out.model_dump())
+    return out
+
+def _replay_stream(reply: Dict[str, Any]) -> AsyncIterator[str]:
+    """Answer a duplicate stream request with the original reply as one token plus trailer"""
+    async def events() -> AsyncIterator[str]:
+        if reply.get("reply"):
+            yield _sse("token", {"content": reply["reply"]})
+        yield _sse("done", reply)
+    return events()
+
+@router.post("/stream")
+async def chat_stream(
+    req: ChatIn,
+    idempotency_key: Optional[str] = Header(None, description="Client message ID; retries with the same key replay the original reply")
+):
+    """Process chat message and stream LLM tokens as Server-Sent Events
+    
+    Emits ``token`` events while the llm node generates, then a single ``done``
+    trailer carrying the final reply, CRM notes and agent id. A retried
+    ``Idempotency-Key`` replays the original reply instead of running the model.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    replay = await _claim(req, idempotency_key)
+    if replay is not None:
+        return StreamingResponse(_replay_stream(replay), media_type="text/event-stream", headers=headers)
+    
+    try:
+        agent, state, config = await _build_state(req)
+    except BaseException as e:
+        if idempotency_key is not None:
+            await idempotency_store.release("chat", req.tenant_id, idempotency_key, e)
+        raise
+    
+    started = False
+    
+    async def event_stream() -> AsyncIterator[str]:
+        nonlocal started
+        started = True
+        result: Dict[str, Any] = {}
+        error: Optional[BaseException] = None
+        done: Optional[Dict[str, Any]] = None
+        try:
+            async for kind, value in _graph_events(state, config):
+                if kind == "token":
+                    yield _sse("token", {"content": value})
+                else:
+                    result = value
+            
+            logger.info(f"Chat streamed for session {req.session_id}")
+            
+            done = ChatOut(
+                reply=result.get("response", ""),
+                notes_for_crm=result.get("notes_for_crm"),
+                agent_id=agent["id"],
+                session_id=req.session_id
+            ).model_dump()
+            yield _sse("done", done)
+            
+        except AdmissionRejected as e:
+            error = _chat_error(req, e)
+            yield _sse("error", {"status": 429, "detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Chat streaming failed: {str(e)}")
+            error = HTTPException(500, f"Chat processing failed: {str(e)}")
+            yield _sse("error", {"detail": f"Chat processing failed: {str(e)}"})
+        except BaseException as e:
+            # Client disconnected mid-stream
+            error = e
+            raise
+        finally:
+            if idempotency_key is not None:
+                if done is not None:
+                    await idempotency_store.complete("chat", req.tenant_id, idempotency_key, done)
+                else:
+                    error = error or HTTPException(500, "Chat stream ended early")
+                    await idempotency_store.release("chat", req.tenant_id, idempotency_key, error)
+    
+    async def release_unstarted() -> None:
+        # A client that leaves before the body starts skips event_stream's finally
+        if idempotency_key is not None and not started:
+            await idempotency_store.release(
+                "chat", req.tenant_id, idempotency_key, HTTPException(500, "Chat stream never started")
+            )
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=headers,
+        background=BackgroundTask(release_unstarted)
+    )
@@ -0,0 +1,293 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import json
+import os
+import time
+import uuid
+import logging
+from .chat import ChatIn, ChatOut, _agent_state, _chat_error, _graph_events
+from ..database import Database
+from ..deps import get_db_pool
+from ..cache import get_agent_cached
+from ..idempotency import idempotency_store, request_fingerprint, IdempotencyError
+from ..agents.memory import HISTORY_IDLE_SECONDS, HISTORY_MAX_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1/chat", tags=["chat"])
+
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "5000"))
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+# Close connections that send nothing (not even a pong) for this long
+WS_CLIENT_TIMEOUT_SECONDS = float(os.getenv("WS_CLIENT_TIMEOUT_SECONDS", "60"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_MAX_PENDING_MESSAGES = int(os.getenv("WS_MAX_PENDING_MESSAGES", "4"))
+WS_MAX_QUEUED_FRAMES = int(os.getenv("WS_MAX_QUEUED_FRAMES", "256"))
+# Push a lead-capture prompt after this many turns without a lead (0 disables)
+WS_LEAD_PROMPT_AFTER_TURNS = int(os.getenv("WS_LEAD_PROMPT_AFTER_TURNS", "3"))
+DEFAULT_LEAD_PROMPT = "Would you like us to follow up? Leave your email or phone number and we'll be in touch."
+
+# Close codes
+WS_TRY_AGAIN_LATER = 1013
+WS_POLICY_VIOLATION = 1008
+
+_open_connections = 0
+
+def open_connections() -> int:
+    """WebSocket connections currently open on this worker"""
+    return _open_connections
+
+class SlowConsumer(Exception):
+    """Client is not reading frames fast enough"""
+
+class FrameQueue:
+    """Outbound frames for one connection
+
+    Consecutive token frames for the same message are merged, so a slow reader
+    gets fewer, larger frames and the model stream never waits on the socket.
+    Other frames are bounded; overflowing them means the client stopped reading.
+    """
+
+    def __init__(self, max_frames: int):
+        self.max_frames = max_frames
+        self._frames: Deque[Dict[str, Any]] = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, frame: Dict[str, Any]) -> None:
+        last = self._frames[-1] if self._frames else None
+        if (frame["type"] == "token" and last is not None
+                and last["type"] == "token" and last["id"] == frame["id"]):
+            last["content"] += frame["content"]
+            return
+        if len(self._frames) >= self.max_frames:
+            raise SlowConsumer(f"More than {self.max_frames} frames queued")
+        self._frames.append(frame)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next frame, or None if nothing was queued within ``timeout``"""
+        if not self._frames:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._frames.popleft()
+
+class WidgetConnection:
+    """One widget session bound to a tenant, agent and session for its lifetime
+
+    The agent is resolved at connect time and the session history is kept
+    between turns, so a turn skips the agent lookup round trip and the history
+    load. Turns run one at a time in arrival order; up to
+    ``WS_MAX_PENDING_MESSAGES`` more may wait behind the current one.
+    """
+
+    def __init__(self, websocket: WebSocket, tenant_id: str, agent_name: str, session_id: str,
+                 lead_id: Optional[str]):
+        self.websocket = websocket
+        self.tenant_id = tenant_id
+        self.agent_name = agent_name
+        self.session_id = session_id
+        self.lead_id = lead_id
+        self.agent: Optional[Dict[str, Any]] = None
+        self.history: Optional[List[Any]] = None
+        self.history_at = 0.0
+        self.turns = 0
+        self.lead_prompted = False
+        self.outbox = FrameQueue(WS_MAX_QUEUED_FRAMES)
+        self.inbox: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(WS_MAX_PENDING_MESSAGES)
+
+    async def _resolve_agent(self) -> Optional[Dict[str, Any]]:
+        # Cache hit unless the agent was edited; edits apply from the next turn
+        agent = await get_agent_cached(Database(await get_db_pool()), self.tenant_id, self.agent_name)
+        if agent is not None and self.agent is not None and agent["id"] != self.agent["id"]:
+            self.history = None
+        self.agent = agent
+        return agent
+
+    async def run(self) -> None:
+        # Accept before closing: a close during the handshake is an HTTP 403 and the code is lost
+        await self.websocket.accept()
+        if await self._resolve_agent() is None:
+            await self.websocket.close(WS_POLICY_VIOLATION, f"Agent '{self.agent_name}' not found")
+            return
+        self.outbox.put({"type": "ready", "agent_id": self.agent["id"], "session_id": self.session_id})
+
+        tasks = [asyncio.create_task(t) for t in (self._read(), self._write(), self._work())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if isinstance(error, SlowConsumer):
+                    logger.warning(f"Closing slow WebSocket for session {self.session_id}: {str(error)}")
+                    await self.websocket.close(WS_TRY_AGAIN_LATER, "Slow consumer")
+                elif error is not None and not isinstance(error, WebSocketDisconnect):
+                    logger.error(f"WebSocket session {self.session_id} failed: {str(error)}")
+        finally:
+            # Cancels an in-flight turn too, freeing its LLM slot
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                text = await asyncio.wait_for(self.websocket.receive_text(), WS_CLIENT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.info(f"WebSocket for session {self.session_id} missed heartbeats; closing")
+                await self.websocket.close()
+                return
+            try:
+                frame = json.loads(text)
+            except ValueError:
+                frame = None
+            kind = frame.get("type") if isinstance(frame, dict) else None
+            if kind == "message":
+                try:
+                    self.inbox.put_nowait(frame)
+                except asyncio.QueueFull:
+                    self.outbox.put({"type": "error", "id": frame.get("id"), "status": 429,
+                                     "detail": "Too many messages waiting for a reply"})
+            elif kind == "lead":
+                self.lead_id = frame.get("lead_id") or self.lead_id
+            elif kind == "ping":
+                self.outbox.put({"type": "pong"})
+            elif kind != "pong":
+                self.outbox.put({"type": "error", "status": 400, "detail": f"Unknown frame type: {kind}"})
+
+    async def _write(self) -> None:
+        while True:
+            frame = await self.outbox.get(WS_HEARTBEAT_SECONDS)
+            if frame is None:
+                frame = {"type": "ping"}
+            try:
+                await asyncio.wait_for(self.websocket.send_json(frame), WS_SEND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                raise SlowConsumer(f"Send blocked for {WS_SEND_TIMEOUT_SECONDS}s")
+
+    async def _work(self) -> None:
+        while True:
+            frame = await self.inbox.get()
+            self.outbox.put({"type": "typing", "state": True})
+            try:
+                await self._turn(frame)
+            finally:
+                self.outbox.put({"type": "typing", "state": False})
+            self._maybe_prompt_for_lead()
+
+    async def _turn(self, frame: Dict[str, Any]) -> None:
+        message_id = str(frame.get("id") or uuid.uuid4().hex)
+        try:
+            req = ChatIn(
+                tenant_id=self.tenant_id,
+                agent_name=self.agent_name,
+                session_id=self.session_id,
+                user_input=frame.get("content") or "",
+                lead_id=frame.get("lead_id") or self.lead_id,
+            )
+        except ValidationError as e:
+            self.outbox.put({"type": "error", "id": message_id, "status": 422, "detail": str(e)})
+            return
+        self.lead_id = req.lead_id
+
+        # A resent message id (e.g. after a reconnect) returns the original reply. Widgets
+        # number their own messages, so ids are only unique within a session
+        idempotent = frame.get("id") is not None
+        idempotency_key = f"{self.session_id}:{message_id}"
+        if idempotent:
+            try:
+                replay = await idempotency_store.claim(
+                    "chat", req.tenant_id, idempotency_key, request_fingerprint(req.model_dump())
+                )
+            except IdempotencyError as e:
+                self.outbox.put({"type": "error", "id": message_id, "status": e.status, "detail": str(e)})
+                return
+            except Exception as e:
+                # A concurrent original with this id failed; duplicates receive its error
+                self._put_error(message_id, _chat_error(req, e))
+                return
+            if replay is not None:
+                self.outbox.put({"type": "token", "id": message_id, "content": replay["reply"]})
+                self.outbox.put({"type": "done", "id": message_id, **replay})
+                return
+
+        try:
+            agent = await self._resolve_agent()
+            if agent is None:
+                raise HTTPException(404, f"Agent '{req.agent_name}' not found for tenant {req.tenant_id}")
+            state, config = _agent_state(req, agent)
+            if self.history is not None and time.monotonic() - self.history_at < HISTORY_IDLE_SECONDS:
+                state["history"] = self.history
+                state["history_preloaded"] = True
+
+            result: Dict[str, Any] = {}
+            async for kind, value in _graph_events(state, config):
+                if kind == "token":
+                    self.outbox.put({"type": "token", "id": message_id, "content": value})
+                else:
+                    result = value
+            done = ChatOut(
+                reply=result.get("response", ""),
+                notes_for_crm=result.get("notes_for_crm"),
+                agent_id=agent["id"],
+                session_id=req.session_id
+            ).model_dump()
+        except BaseException as e:
+            self.history = None
+            error = _chat_error(req, e) if isinstance(e, Exception) and not isinstance(e, SlowConsumer) else e
+            if idempotent:
+                await idempotency_store.release("chat", req.tenant_id, idempotency_key, error)
+            if not isinstance(error, HTTPException):
+                raise
+            self._put_error(message_id, error)
+            return
+
+        self.history = list(result.get("history") or [])[-HISTORY_MAX_MESSAGES:]
+        self.history_at = time.monotonic()
+        self.turns += 1
+        self.outbox.put({"type": "done", "id": message_id, **done})
+        if idempotent:
+            await idempotency_store.complete("chat", req.tenant_id, idempotency_key, done)
+
+    def _put_error(self, message_id: str, error: HTTPException) -> None:
+        frame = {"type": "error", "id": message_id, "status": error.status_code, "detail": error.detail}
+        if error.status_code == 429 and error.headers:
+            frame["retry_after"] = float(error.headers["Retry-After"])
+        self.outbox.put(frame)
+
+    def _maybe_prompt_for_lead(self) -> None:
+        """Server-pushed lead capture prompt, once per connection"""
+        if (self.lead_id or self.lead_prompted or not WS_LEAD_PROMPT_AFTER_TURNS
+                or self.turns < WS_LEAD_PROMPT_AFTER_TURNS):
+            return
+        self.lead_prompted = True
+        runtime = (self.agent or {}).get("mission_json", {}).get("runtime", {})
+        self.outbox.put({"type": "prompt", "kind": "lead_capture",
+                         "text": runtime.get("lead_prompt") or DEFAULT_LEAD_PROMPT})
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket, tenant_id: str, agent_name: str, session_id: str,
+                  lead_id: Optional[str] = None):
+    """Persistent widget session: JSON frames in both directions
+
+    Client frames: ``message`` (``id``, ``content``, optional ``lead_id``),
+    ``lead`` (bind a captured ``lead_id``), ``ping`` and ``pong``. Server
+    frames: ``ready``, ``typing``, ``token``, ``done``, ``error``, ``prompt``
+    (lead capture), ``ping`` (answer with ``pong``) and ``pong``.
+    """
+    global _open_connections
+    if _open_connections >= WS_MAX_CONNECTIONS:
+        await websocket.accept()
+        await websocket.close(WS_TRY_AGAIN_LATER, "Connection limit reached")
+        return
+    _open_connections += 1
+    try:
+        await WidgetConnection(websocket, tenant_id, agent_name, session_id, lead_id).run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _open_connections -= 1
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from ..database import Database
 from ..deps import get_db_pool
-from ..repo import push_to_ghl
-from typing import Optional, List
+from ..outbox import ghl_outbox_worker
+from ..idempotency import idempotency_store, request_fingerprint, IdempotencyError
+import os
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from datetime import datetime
+import base64
+import codecs
+import csv
+import io
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,42 +39,255 @@ class LeadOut(BaseModel):
     ghl_contact_id: Optional[str]
     created_at: Optional[str]
     updated_at: Optional[str]
+    ghl_status: Optional[str] = None  # "pending" while a GHL push is queued
+
+class LeadPage(BaseModel):
+    items: List[LeadOut]
+    next_cursor: Optional[str] = None
+
+EXPORT_FIELDS = ["id", "tenant_id", "first_name", "last_name", "email", "phone",
+                 "notes", "ghl_contact_id", "created_at", "updated_at"]
+EXPORT_CHUNK_ROWS = 500
+
+class BulkLeadResult(BaseModel):
+    row_no: int
+    status: str  # created | updated | merged | invalid
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkLeadOut(BaseModel):
+    created: int
+    updated: int
+    merged: int
+    invalid: int
+    results: List[BulkLeadResult]
+
+BULK_BATCH_ROWS = int(os.getenv("LEADS_BULK_BATCH_ROWS", "5000"))
+
+def _lead_error(lead: LeadIn) -> Optional[str]:
+    """Validation shared by single and bulk lead submission"""
+    if not lead.email and not lead.phone:
+        return "Either email or phone is required"
+    return None
+
+def _lead_row(lead: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce DB values (UUIDs, timestamps) to the string forms the API exposes"""
+    row = dict(lead)
+    for key in ("id", "tenant_id"):
+        if row.get(key) is not None:
+            row[key] = str(row[key])
+    for key in ("created_at", "updated_at"):
+        if isinstance(row.get(key), datetime):
+            row[key] = row[key].isoformat()
+    return row
+
+def _encode_cursor(lead: Dict[str, Any]) -> str:
+    raw = json.dumps([lead["created_at"].isoformat(), str(lead["id"])])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, lead_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), lead_id
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
 
 @router.post("", response_model=LeadOut)
-async def create_or_update_lead(lead_data: LeadIn):
+async def create_or_update_lead(
+    lead_data: LeadIn,
+    idempotency_key: Optional[str] = Header(None, description="Client submit ID; retries with the same key return the original lead")
+):
     """Create or update a lead, optionally pushing to GoHighLevel"""
     
     # Validate that we have at least email or phone
-    if not lead_data.email and not lead_data.phone:
-        raise HTTPException(400, "Either email or phone is required")
+    error = _lead_error(lead_data)
+    if error:
+        raise HTTPException(400, error)
     
-    # Get database instance
-    pool = await get_db_pool()
-    db = Database(pool)
+    # A retried submit returns the first result instead of upserting and pushing again
+    if idempotency_key is not None:
+        try:
+            replay = await idempotency_store.claim(
+                "lead", lead_data.tenant_id, idempotency_key, request_fingerprint(lead_data.model_dump())
+            )
+        except IdempotencyError as e:
+            raise HTTPException(e.status, str(e))
+        if replay is not None:
+            return LeadOut(**replay)
     
-    # Upsert lead in database
-    lead = await db.upsert_lead(lead_data.tenant_id, lead_data.model_dump())
+    try:
+        # Get database instance
+        pool = await get_db_pool()
+        db = Database(pool)
+        
+        # Upsert lead and enqueue the GHL push atomically; the outbox worker delivers it
+        lead = await db.upsert_lead(
+            lead_data.tenant_id,
+            lead_data.model_dump(),
+            enqueue_ghl=lead_data.push_to_ghl
+        )
+    except BaseException as e:
+        if idempotency_key is not None:
+            await idempotency_store.release("lead", lead_data.tenant_id, idempotency_key, e)
+        raise
     
-    # Push to GoHighLevel if requested
-    ghl_contact_id = None
     if lead_data.push_to_ghl:
+        ghl_outbox_worker.notify()
+        lead["ghl_status"] = "pending"
+    
+    out = LeadOut(**_lead_row(lead))
+    if idempotency_key is not None:
+        await idempotency_store.complete("lead", lead_data.tenant_id, idempotency_key, out.model_dump())
+    return out
+
+async def _request_lines(request: Request) -> AsyncIterator[str]:
+    """Yield decoded lines from a streamed request body"""
+    # Incremental so a multibyte character split across network chunks decodes
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def _request_records(request: Request, format: str) -> AsyncIterator[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    """Parse NDJSON objects or CSV rows (header required) from the request body
+    
+    Yields ``(record, None)`` or ``(None, error)`` so one bad line doesn't stop the load.
+    """
+    header: Optional[List[str]] = None
+    partial = ""
+    async for line in _request_lines(request):
+        if format == "csv":
+            # A quoted field may contain newlines; buffer until the quotes balance
+            partial = f"{partial}\n{line}" if partial else line
+            if partial.count('"') % 2:
+                continue
+            line, partial = partial, ""
+        if not line.strip():
+            continue
         try:
-            ghl_contact_id = await push_to_ghl(lead)
-            if ghl_contact_id:
-                await db.update_lead_ghl_id(lead["id"], ghl_contact_id)
-                lead["ghl_contact_id"] = ghl_contact_id
-                logger.info(f"Lead {lead['id']} pushed to GHL: {ghl_contact_id}")
-        except Exception as e:
-            logger.error(f"Failed to push lead to GHL: {str(e)}")
-            # Don't fail the request if GHL push fails
-    
-    return LeadOut(**lead)
-
-@router.get("/{tenant_id}")
-async def get_leads(tenant_id: str):
-    """Get all leads for a tenant"""
+            if format == "ndjson":
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                yield record, None
+            elif header is None:
+                header = [h.strip() for h in next(csv.reader([line]))]
+            else:
+                yield dict(zip(header, next(csv.reader([line])))), None
+        except (ValueError, csv.Error) as e:
+            yield None, f"Unparseable row: {str(e)}"
+    if partial:
+        yield None, "Unparseable row: unterminated quoted field"
+
+@router.post("/bulk/{tenant_id}", response_model=BulkLeadOut)
+async def bulk_upsert_leads(
+    tenant_id: str,
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    push_to_ghl: bool = Query(False, description="Enqueue GHL pushes for every upserted lead")
+):
+    """Bulk-load leads from an NDJSON or CSV body
+    
+    Rows are validated like ``POST /api/v1/leads`` and merged in batches with
+    COPY into a staging table plus a single set-based upsert per batch.
+    Rows are numbered from 1 in body order (excluding the CSV header).
+    """
+    pool = await get_db_pool()
+    db = Database(pool)
+    
+    results: List[Dict[str, Any]] = []
+    batch: List[Dict[str, Any]] = []
+    
+    async def flush() -> None:
+        if batch:
+            results.extend(await db.bulk_upsert_leads(tenant_id, batch, enqueue_ghl=push_to_ghl))
+            batch.clear()
+    
+    row_no = 0
+    async for record, error in _request_records(request, format):
+        row_no += 1
+        if error is None:
+            try:
+                fields = {k: (v if v != "" else None) for k, v in record.items() if k in LeadIn.model_fields}
+                lead = LeadIn(**{**fields, "tenant_id": tenant_id, "push_to_ghl": push_to_ghl})
+                error = _lead_error(lead)
+            except ValidationError as e:
+                error = str(e)
+        if error:
+            results.append({"row_no": row_no, "status": "invalid", "error": error})
+            continue
+        
+        batch.append({**lead.model_dump(), "row_no": row_no})
+        if len(batch) >= BULK_BATCH_ROWS:
+            await flush()
+    await flush()
+    
+    if push_to_ghl:
+        ghl_outbox_worker.notify()
+    
+    results.sort(key=lambda r: r["row_no"])
+    counts = {status: 0 for status in ("created", "updated", "merged", "invalid")}
+    for result in results:
+        counts[result["status"]] += 1
+    logger.info(f"Bulk lead load for tenant {tenant_id}: {counts}")
+    return BulkLeadOut(**counts, results=results)
+
+@router.get("/{tenant_id}", response_model=LeadPage)
+async def get_leads(
+    tenant_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """Get one page of leads for a tenant, newest first"""
+    pool = await get_db_pool()
+    db = Database(pool)
+    
+    after = _decode_cursor(cursor) if cursor else None
+    leads = await db.get_leads_page(tenant_id, limit, after)
+    next_cursor = _encode_cursor(leads[-1]) if len(leads) == limit else None
+    return LeadPage(items=[LeadOut(**_lead_row(lead)) for lead in leads], next_cursor=next_cursor)
+
+@router.get("/{tenant_id}/export")
+async def export_leads(tenant_id: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Stream every lead for a tenant as NDJSON or CSV in constant memory"""
     pool = await get_db_pool()
     db = Database(pool)
     
-    leads = await db.get_leads_by_tenant(tenant_id)
-    return [LeadOut(**lead) for lead in leads]
\ No newline at end of file
+    async def ndjson_rows() -> AsyncIterator[str]:
+        chunk = []
+        async for lead in db.stream_leads(tenant_id, prefetch=EXPORT_CHUNK_ROWS):
+            row = _lead_row(lead)
+            chunk.append(json.dumps({k: row.get(k) for k in EXPORT_FIELDS}, ensure_ascii=False))
+            if len(chunk) >= EXPORT_CHUNK_ROWS:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+    
+    async def csv_rows() -> AsyncIterator[str]:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        rows = 0
+        async for lead in db.stream_leads(tenant_id, prefetch=EXPORT_CHUNK_ROWS):
+            writer.writerow(_lead_row(lead))
+            rows += 1
+            if rows % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    if format == "csv":
+        return StreamingResponse(
+            csv_rows(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="leads-{tenant_id}.csv"'}
+        )
+    return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from backend import idempotency
+from backend.idempotency import IdempotencyError, IdempotencyStore
+
+RESULT = {"reply": "Hello!", "session_id": "s1"}
+
+def make_store() -> IdempotencyStore:
+    return IdempotencyStore("memory", ttl_seconds=60, max_entries=100)
+
+def test_duplicate_key_replays_the_stored_result():
+    store = make_store()
+
+    async def run():
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+        await store.complete("chat", "t1", "k1", RESULT)
+        assert await store.claim("chat", "t1", "k1", "fp") == RESULT
+        # Keys are scoped per tenant
+        assert await store.claim("chat", "t2", "k1", "fp") is None
+
+    asyncio.run(run())
+
+def test_reused_key_with_a_different_body_is_rejected():
+    store = make_store()
+
+    async def run():
+        await store.claim("chat", "t1", "k1", "fp")
+        await store.complete("chat", "t1", "k1", RESULT)
+        with pytest.raises(IdempotencyError) as exc:
+            await store.claim("chat", "t1", "k1", "other")
+        assert exc.value.status == 422
+
+    asyncio.run(run())
+
+def test_concurrent_duplicate_waits_for_the_original():
+    store = make_store()
+
+    async def run():
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+        duplicate = asyncio.create_task(store.claim("chat", "t1", "k1", "fp"))
+        await asyncio.sleep(0)
+        assert not duplicate.done()
+        await store.complete("chat", "t1", "k1", RESULT)
+        assert await duplicate == RESULT
+
+    asyncio.run(run())
+
+def test_failed_claim_is_released_and_can_be_reclaimed():
+    store = make_store()
+
+    async def run():
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+        duplicate = asyncio.create_task(store.claim("chat", "t1", "k1", "fp"))
+        await asyncio.sleep(0)
+        await store.release("chat", "t1", "k1", HTTPException(500, "model failed"))
+        # Waiting duplicates receive the original's error...
+        with pytest.raises(HTTPException):
+            await duplicate
+        # ...and a later retry runs the request again
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+
+    asyncio.run(run())
+
+def test_waiting_duplicate_times_out_and_abandoned_claim_expires(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.05)
+    store = make_store()
+
+    async def run():
+        # The original never completes or releases (e.g. its client left before streaming)
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+        with pytest.raises(IdempotencyError) as exc:
+            await store.claim("chat", "t1", "k1", "fp")
+        assert exc.value.status == 409
+        assert await store.claim("chat", "t1", "k1", "fp") is None
+
+    asyncio.run(run())
+
+def test_rejects_empty_and_overlong_keys():
+    store = make_store()
+
+    async def run():
+        for key in ("", "x" * 256):
+            with pytest.raises(IdempotencyError) as exc:
+                await store.claim("chat", "t1", key, "fp")
+            assert exc.value.status == 400
+
+    asyncio.run(run())
@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, Dict, List
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from backend.database import Database
+from backend.routers import leads
+
+class FakeRequest:
+    """Streams a body in fixed-size chunks, like a real upload arriving over the network"""
+
+    def __init__(self, body: str, chunk_size: int = 3):
+        self.body = body.encode("utf-8")
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+def parse(body: str, format: str, chunk_size: int = 3) -> List[Any]:
+    async def run():
+        return [r async for r in leads._request_records(FakeRequest(body, chunk_size), format)]
+    return asyncio.run(run())
+
+def test_ndjson_reports_malformed_and_non_object_lines_and_skips_blanks():
+    records = parse('{"email": "a@x.com"}\n\nnot json\n[1, 2]\n{"phone": "555"}\n', "ndjson")
+    assert records[0] == ({"email": "a@x.com"}, None)
+    assert records[1][0] is None and records[1][1].startswith("Unparseable row")
+    assert records[2] == (None, "Unparseable row: expected a JSON object")
+    assert records[3] == ({"phone": "555"}, None)
+    assert len(records) == 4
+
+def test_csv_uses_the_stripped_header_and_handles_crlf():
+    records = parse(" first_name , email\r\nAda,ada@x.com\r\n\r\nBob,bob@x.com", "csv")
+    assert records == [
+        ({"first_name": "Ada", "email": "ada@x.com"}, None),
+        ({"first_name": "Bob", "email": "bob@x.com"}, None),
+    ]
+
+def test_csv_quoted_fields_may_span_lines():
+    body = 'email,notes\na@x.com,"Called twice\n\nPrefers ""email"", not phone"\nb@x.com,short\n'
+    records = parse(body, "csv")
+    assert records == [
+        ({"email": "a@x.com", "notes": 'Called twice\n\nPrefers "email", not phone'}, None),
+        ({"email": "b@x.com", "notes": "short"}, None),
+    ]
+
+def test_csv_unterminated_quote_is_reported_once_at_end():
+    records = parse('email,notes\na@x.com,"never closed\nb@x.com,fine\n', "csv")
+    assert records == [(None, "Unparseable row: unterminated quoted field")]
+
+def test_multibyte_characters_split_across_chunks_decode():
+    records = parse('{"first_name": "Zoë 😀", "email": "z@x.com"}\n', "ndjson", chunk_size=1)
+    assert records == [({"first_name": "Zoë 😀", "email": "z@x.com"}, None)]
+
+class FakeDatabase:
+    batches: List[List[Dict[str, Any]]] = []
+
+    def __init__(self, pool):
+        pass
+
+    async def bulk_upsert_leads(self, tenant_id, rows, enqueue_ghl=False):
+        FakeDatabase.batches.append(list(rows))
+        return [{"row_no": row["row_no"], "id": f"lead-{row['row_no']}", "status": "created"} for row in rows]
+
+def test_bulk_endpoint_validates_rows_and_numbers_them_in_body_order(monkeypatch):
+    async def fake_pool():
+        return None
+    monkeypatch.setattr(leads, "get_db_pool", fake_pool)
+    monkeypatch.setattr(leads, "Database", FakeDatabase)
+    FakeDatabase.batches = []
+    app = FastAPI()
+    app.include_router(leads.router)
+
+    body = "first_name,email,phone,unknown\nAda,ada@x.com,,ignored\nNo Contact,,,\n\"broken,x\nBob,,555,\n"
+    response = TestClient(app).post("/api/v1/leads/bulk/t1?format=csv", content=body)
+
+    assert response.status_code == 200
+    out = response.json()
+    assert (out["created"], out["invalid"]) == (1, 2)
+    assert [(r["row_no"], r["status"]) for r in out["results"]] == [(1, "created"), (2, "invalid"), (3, "invalid")]
+    assert out["results"][1]["error"] == "Either email or phone is required"
+    # The unterminated quote swallows the rest of the body and is reported as one bad row
+    assert out["results"][2]["error"] == "Unparseable row: unterminated quoted field"
+    [batch] = FakeDatabase.batches
+    assert [(row["row_no"], row["email"], row["phone"]) for row in batch] == [(1, "ada@x.com", None)]
+    assert "unknown" not in batch[0]
+
+def staged(row_no: int, email: str = None) -> tuple:
+    return (row_no, f"staged-{row_no}", None, None, email, None, None)
+
+def test_bulk_results_mark_earlier_duplicates_in_a_batch_as_merged():
+    records = [staged(1, "a@x.com"), staged(2, None), staged(3, "a@x.com"), staged(4, "b@x.com")]
+    # What the DISTINCT ON merge returns: one row per email (the last one) plus rows without email
+    merged = [
+        {"id": "lead-a", "email": "a@x.com", "inserted": False},
+        {"id": "staged-2", "email": None, "inserted": True},
+        {"id": "lead-b", "email": "b@x.com", "inserted": True},
+    ]
+    assert Database._bulk_results(records, merged) == [
+        {"row_no": 1, "id": "lead-a", "status": "merged"},
+        {"row_no": 2, "id": "staged-2", "status": "created"},
+        {"row_no": 3, "id": "lead-a", "status": "updated"},
+        {"row_no": 4, "id": "lead-b", "status": "created"},
+    ]
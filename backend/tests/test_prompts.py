@@ -0,0 +1,20 @@
+from backend.agents.prompts import render_system_prompt
+
+def test_scalar_list_fields_render_as_single_items():
+    prompt = render_system_prompt(
+        "Be helpful.",
+        {"name": "Ava", "capabilities": "booking"},
+        {"guidelines": "Keep replies short", "compliance": "No medical advice", "routing_options": "Pricing page"},
+    )
+    assert "Capabilities: booking" in prompt
+    assert "## Guidelines\n- Keep replies short" in prompt
+    assert "## Compliance (always follow)\n- No medical advice" in prompt
+    assert "- Pricing page" in prompt
+
+def test_non_dict_personality_renders_as_text():
+    prompt = render_system_prompt("Be helpful.", {"personality": "friendly"}, {})
+    assert "## Identity\nPersonality: friendly" in prompt
+
+def test_list_fields_still_render_one_bullet_per_item():
+    prompt = render_system_prompt("Be helpful.", {}, {"guidelines": ["One", "Two"]})
+    assert "## Guidelines\n- One\n- Two" in prompt
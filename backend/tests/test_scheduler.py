@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from backend.agents import scheduler
+from backend.agents.scheduler import AdmissionRejected, LLMScheduler
+
+@pytest.fixture(autouse=True)
+def local_limits(monkeypatch):
+    monkeypatch.setattr(scheduler, "RATE_LIMIT_BACKEND", "memory")
+    monkeypatch.setattr(scheduler, "TENANT_LIMITS", {})
+    monkeypatch.setattr(scheduler, "TENANT_RPM", 1000)
+    monkeypatch.setattr(scheduler, "TENANT_TPM", 1_000_000)
+
+def window_tokens(sched: LLMScheduler, tenant_id: str) -> int:
+    return sum(used for (tenant, _), (_, used) in sched._local._counts.items() if tenant == tenant_id)
+
+def test_admits_requests_under_the_limit_and_rejects_over_it(monkeypatch):
+    monkeypatch.setattr(scheduler, "TENANT_RPM", 2)
+    sched = LLMScheduler(concurrency=4, tenant_max_queued=4, max_queued=10)
+
+    async def run():
+        for _ in range(2):
+            async with sched.slot("t1", 10):
+                pass
+        with pytest.raises(AdmissionRejected):
+            async with sched.slot("t1", 10):
+                pass
+        # Limits are per tenant
+        async with sched.slot("t2", 10):
+            pass
+
+    asyncio.run(run())
+    assert sched.rejections == {"t1": 1}
+
+def test_rejects_when_estimated_tokens_exceed_tpm(monkeypatch):
+    monkeypatch.setattr(scheduler, "TENANT_LIMITS", {"t1": {"tpm": 100}})
+    sched = LLMScheduler(concurrency=4, tenant_max_queued=4, max_queued=10)
+
+    async def run():
+        async with sched.slot("t1", 60):
+            pass
+        with pytest.raises(AdmissionRejected):
+            async with sched.slot("t1", 60):
+                pass
+
+    asyncio.run(run())
+
+def test_queues_beyond_concurrency_and_rejects_when_tenant_queue_is_full():
+    sched = LLMScheduler(concurrency=1, tenant_max_queued=1, max_queued=10)
+
+    async def run():
+        holding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with sched.slot("t1", 10):
+                holding.set()
+                await release.wait()
+
+        async def queued():
+            async with sched.slot("t1", 10):
+                pass
+
+        first = asyncio.create_task(hold())
+        await holding.wait()
+        second = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        assert sched.stats()["queued"] == 1
+        with pytest.raises(AdmissionRejected):
+            async with sched.slot("t1", 10):
+                pass
+        release.set()
+        await asyncio.gather(first, second)
+        assert sched.stats()["active"] == 0
+
+    asyncio.run(run())
+
+def test_waiting_requests_are_granted_in_fair_order_across_tenants():
+    sched = LLMScheduler(concurrency=1, tenant_max_queued=10, max_queued=10)
+    granted = []
+
+    async def run():
+        holding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with sched.slot("busy", 100):
+                holding.set()
+                await release.wait()
+
+        async def request(tenant_id: str, n: int):
+            async with sched.slot(tenant_id, 100):
+                granted.append(f"{tenant_id}{n}")
+
+        holder = asyncio.create_task(hold())
+        await holding.wait()
+        tasks = []
+        # The busy tenant queues three requests before the quiet one queues its first
+        for tenant_id, n in (("busy", 1), ("busy", 2), ("busy", 3), ("quiet", 1)):
+            tasks.append(asyncio.create_task(request(tenant_id, n)))
+            await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(run())
+    assert granted == ["busy1", "quiet1", "busy2", "busy3"]
+
+def test_settle_replaces_the_estimate_in_the_token_window(monkeypatch):
+    monkeypatch.setattr(scheduler, "TENANT_LIMITS", {"t1": {"tpm": 5000}})
+    sched = LLMScheduler(concurrency=4, tenant_max_queued=4, max_queued=10)
+
+    async def run():
+        async with sched.slot("t1", 3000) as settle:
+            pass
+        await settle(400)
+        assert window_tokens(sched, "t1") == 400
+        # Without the correction this second reservation would exceed the tpm limit
+        async with sched.slot("t1", 3000):
+            pass
+        assert window_tokens(sched, "t1") == 3400
+
+    asyncio.run(run())
+
+def test_tenant_limits_reject_non_positive_weight():
+    with pytest.raises(ValueError):
+        scheduler._load_tenant_limits('{"t1": {"weight": 0}}')
+    assert scheduler._load_tenant_limits('{"t1": {"weight": 2}}') == {"t1": {"weight": 2}}
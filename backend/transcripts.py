@@ -0,0 +1,167 @@
+from datetime import date, datetime, timezone
+from typing import List, Optional, Set, Tuple
+import asyncio
+import os
+import uuid
+import logging
+import asyncpg
+from .database import Database
+from .deps import get_db_pool
+from .metrics import TRANSCRIPT_DROPPED
+from .outbox import backoff_seconds
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_ENABLED = os.getenv("TRANSCRIPT_ENABLED", "true").lower() == "true"
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", "50000"))
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "500"))
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "1"))
+# Writes of a failed batch before its rows are dropped, and the cap on the backoff between them
+TRANSCRIPT_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPT_MAX_ATTEMPTS", "8"))
+TRANSCRIPT_RETRY_MAX_SECONDS = float(os.getenv("TRANSCRIPT_RETRY_MAX_SECONDS", "30"))
+# Whole months of transcripts to keep; older partitions are dropped (0 keeps everything)
+TRANSCRIPT_RETENTION_MONTHS = int(os.getenv("TRANSCRIPT_RETENTION_MONTHS", "12"))
+TRANSCRIPT_MAINTENANCE_SECONDS = float(os.getenv("TRANSCRIPT_MAINTENANCE_SECONDS", "3600"))
+
+# (id, tenant_id, agent_id, session_id, lead_id, role, content, created_at)
+MessageRecord = Tuple[uuid.UUID, str, str, str, Optional[str], str, str, datetime]
+
+def month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+class TranscriptWriter:
+    """Write-behind log of chat messages into the partitioned ``messages`` table
+
+    ``log_turn`` never awaits, so the transcript adds no latency to a reply. A
+    background task copies up to ``batch_size`` rows (or whatever arrived within
+    ``flush_seconds``) with one COPY. A failed batch is retried with backoff
+    before anything queued behind it, and dropped (and counted) only after
+    ``TRANSCRIPT_MAX_ATTEMPTS`` tries. Monthly partitions are created ahead of
+    use, and partitions past the retention window are dropped rather than
+    deleted from.
+    """
+
+    def __init__(self, batch_size: int, flush_seconds: float, queue_size: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._maintenance: Optional[asyncio.Task] = None
+        self._months: Set[date] = set()
+
+    def start(self) -> None:
+        """Start partition maintenance; the flush task starts with the first message"""
+        if self._maintenance is None:
+            self._maintenance = asyncio.create_task(self._maintain())
+
+    def log_turn(self, tenant_id: str, agent_id: str, session_id: str, lead_id: Optional[str],
+                 user_input: str, reply: str, received_at: datetime) -> None:
+        """Queue the user message and the reply of one turn"""
+        if not TRANSCRIPT_ENABLED:
+            return
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        replied_at = datetime.now(timezone.utc)
+        for role, content, created_at in (("user", user_input, received_at), ("assistant", reply, replied_at)):
+            try:
+                self._queue.put_nowait(
+                    (uuid.uuid4(), tenant_id, str(agent_id), session_id, lead_id, role, content, created_at)
+                )
+            except asyncio.QueueFull:
+                TRANSCRIPT_DROPPED.labels(reason="queue_full").inc()
+                logger.warning("Transcript queue full; dropping message")
+
+    async def _next_batch(self) -> List[MessageRecord]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_with_retry(self, batch: List[MessageRecord]) -> None:
+        attempt = 1
+        while True:
+            try:
+                await self._write(batch)
+                return
+            except asyncpg.UniqueViolationError as e:
+                if attempt > 1:
+                    # COPY is atomic: an earlier attempt committed even though its reply was lost
+                    logger.info(f"Transcript batch of {len(batch)} messages was already stored")
+                    return
+                TRANSCRIPT_DROPPED.labels(reason="write_failed").inc(len(batch))
+                logger.error(f"Dropping {len(batch)} transcript messages with duplicate ids: {str(e)}")
+                return
+            except Exception as e:
+                if attempt >= TRANSCRIPT_MAX_ATTEMPTS:
+                    TRANSCRIPT_DROPPED.labels(reason="write_failed").inc(len(batch))
+                    logger.error(f"Dropping {len(batch)} transcript messages after {attempt} failed writes: {str(e)}")
+                    return
+                delay = backoff_seconds(attempt, base=0.5, cap=TRANSCRIPT_RETRY_MAX_SECONDS)
+                logger.warning(f"Transcript write of {len(batch)} messages failed (attempt {attempt}); "
+                               f"retrying in {delay:.1f}s: {str(e)}")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _ensure_partitions(self, db: Database, months: Set[date]) -> None:
+        missing = sorted(months - self._months)
+        if missing:
+            await db.ensure_message_partitions(missing)
+            self._months.update(missing)
+
+    async def _write(self, batch: List[MessageRecord]) -> None:
+        db = Database(await get_db_pool())
+        await self._ensure_partitions(db, {month_start(record[-1]) for record in batch})
+        await db.insert_messages(batch)
+        logger.debug(f"Stored {len(batch)} transcript messages")
+
+    async def _maintain(self) -> None:
+        """Keep this and next month's partitions in place and drop expired ones"""
+        while True:
+            try:
+                db = Database(await get_db_pool())
+                this_month = month_start(datetime.now(timezone.utc))
+                await self._ensure_partitions(db, {this_month, add_months(this_month, 1)})
+                if TRANSCRIPT_RETENTION_MONTHS > 0:
+                    cutoff = add_months(this_month, -TRANSCRIPT_RETENTION_MONTHS)
+                    dropped = await db.drop_message_partitions_before(cutoff)
+                    if dropped:
+                        self._months.difference_update({m for m in self._months if m < cutoff})
+                        logger.info(f"Dropped expired transcript partitions: {', '.join(dropped)}")
+            except Exception as e:
+                logger.error(f"Transcript partition maintenance failed: {str(e)}")
+            await asyncio.sleep(TRANSCRIPT_MAINTENANCE_SECONDS)
+
+    async def close(self) -> None:
+        """Flush queued messages and stop the background tasks"""
+        tasks = [t for t in (self._task, self._maintenance) if t is not None]
+        if self._task is not None:
+            await self._queue.join()
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._maintenance = None
+
+transcript_writer = TranscriptWriter(TRANSCRIPT_BATCH_SIZE, TRANSCRIPT_FLUSH_SECONDS, TRANSCRIPT_QUEUE_SIZE)
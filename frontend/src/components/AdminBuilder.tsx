@@ -203,7 +203,7 @@ Memory:
         <h4 className="font-medium text-sm text-gray-700 mb-2">What happens when you save:</h4>
         <ul className="text-xs text-gray-600 space-y-1">
           <li>• Creates/updates agent in database with multi-tenant isolation</li>
-          <li>• Writes identity.json and mission.json to backend/storage/{tenantId}/</li>
+          <li>• Stores identity and mission as content-addressed blobs under backend/storage/</li>
           <li>• Configures memory mode for session vs persistent storage</li>
           <li>• Makes agent available for chat via /api/v1/chat endpoint</li>
         </ul>
@@ -1,9 +1,13 @@
 import React, { useState, useRef, useEffect } from 'react'
 import { v4 as uuidv4 } from 'uuid'
 import { MessageCircle, X, Send } from 'lucide-react'
-import { postJSON } from '../lib/api'
+import { APIError, ChatSocket, ChatSocketClosed, postSSE } from '../lib/api'
+
+// Attempts for one message over SSE; all share the message's Idempotency-Key
+const SSE_MAX_ATTEMPTS = 3
 
 interface Message {
+  id: string
   role: 'user' | 'ai'
   content: string
   timestamp: Date
@@ -13,6 +17,7 @@ export default function ChatWidget() {
   const [isOpen, setIsOpen] = useState(false)
   const [messages, setMessages] = useState<Message[]>([
     {
+      id: uuidv4(),
       role: 'ai',
       content: "Hi! I'm Elena, your portfolio assistant. How can I help you today?",
       timestamp: new Date()
@@ -22,6 +27,7 @@ export default function ChatWidget() {
   const [isLoading, setIsLoading] = useState(false)
   const [sessionId] = useState(() => uuidv4())
   const messagesEndRef = useRef<HTMLDivElement>(null)
+  const socketRef = useRef<ChatSocket | null>(null)
   
   // Default tenant and agent for demo
   const tenantId = "00000000-0000-0000-0000-000000000001"
@@ -35,10 +41,76 @@ export default function ChatWidget() {
     scrollToBottom()
   }, [messages])
 
+  // One persistent connection per widget session, opened with the panel; turns fall back to SSE without it
+  useEffect(() => {
+    if (!isOpen || socketRef.current) return
+    socketRef.current = new ChatSocket({
+      tenantId,
+      agentName,
+      sessionId,
+      onPrompt: text => setMessages(prev => [...prev, { id: uuidv4(), role: 'ai', content: text, timestamp: new Date() }])
+    })
+    socketRef.current.connect()
+  }, [isOpen])
+
+  useEffect(() => () => {
+    socketRef.current?.close()
+    socketRef.current = null
+  }, [])
+
+  const streamReply = async (content: string, messageKey: string,
+                             setAiContent: (update: (content: string) => string) => void) => {
+    const socket = socketRef.current
+    if (socket?.available) {
+      try {
+        const done = await socket.send(content, text => {
+          setIsLoading(false)
+          setAiContent(() => text)
+        }, messageKey)
+        setAiContent(() => done.reply)
+        return
+      } catch (error) {
+        if (!(error instanceof ChatSocketClosed)) throw error
+        // Connection lost for good: finish this turn over SSE and try the socket again later
+        setAiContent(() => '')
+        socket.connect()
+      }
+    }
+
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await postSSE('/api/v1/chat/stream', {
+          tenant_id: tenantId,
+          agent_name: agentName,
+          session_id: sessionId,
+          user_input: content
+        }, (event, data) => {
+          if (event === 'token') {
+            setIsLoading(false)
+            setAiContent(content => content + data.content)
+          } else if (event === 'done') {
+            setAiContent(() => data.reply)
+          } else if (event === 'error') {
+            throw new Error(data.detail)
+          }
+        }, messageKey)
+        return
+      } catch (error) {
+        // Retry dropped connections (TypeError from fetch) and 409 "still in progress"
+        // with the same key; the server runs the turn once and replays its reply
+        const retryable = error instanceof TypeError || (error instanceof APIError && error.status === 409)
+        if (!retryable || attempt >= SSE_MAX_ATTEMPTS) throw error
+        setAiContent(() => '')
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt))
+      }
+    }
+  }
+
   const sendMessage = async () => {
     if (!input.trim() || isLoading) return
 
     const userMessage: Message = {
+      id: uuidv4(),
       role: 'user',
       content: input.trim(),
       timestamp: new Date()
@@ -49,28 +121,25 @@ export default function ChatWidget() {
     setIsLoading(true)
 
     try {
-      const response = await postJSON('/api/v1/chat', {
-        tenant_id: tenantId,
-        agent_name: agentName,
-        session_id: sessionId,
-        user_input: userMessage.content
-      })
-
-      const aiMessage: Message = {
-        role: 'ai',
-        content: response.reply,
-        timestamp: new Date()
+      // Placeholder AI message that fills in as tokens stream back; matched by id because
+      // server-pushed messages may be appended while the reply streams
+      const aiId = uuidv4()
+      setMessages(prev => [...prev, { id: aiId, role: 'ai', content: '', timestamp: new Date() }])
+
+      const setAiContent = (update: (content: string) => string) => {
+        setMessages(prev => prev.map(m => (m.id === aiId ? { ...m, content: update(m.content) } : m)))
       }
 
-      setMessages(prev => [...prev, aiMessage])
+      await streamReply(userMessage.content, userMessage.id, setAiContent)
     } catch (error) {
       console.error('Chat error:', error)
       const errorMessage: Message = {
+        id: uuidv4(),
         role: 'ai',
         content: "I apologize, but I'm having trouble connecting right now. Please try again in a moment.",
         timestamp: new Date()
       }
-      setMessages(prev => [...prev, errorMessage])
+      setMessages(prev => [...prev.filter(m => m.content !== ''), errorMessage])
     } finally {
       setIsLoading(false)
     }
@@ -115,9 +184,9 @@ export default function ChatWidget() {
 
           {/* Messages */}
           <div className="flex-1 overflow-y-auto p-4 space-y-3">
-            {messages.map((message, index) => (
+            {messages.map(message => message.content && (
               <div
-                key={index}
+                key={message.id}
                 className={`flex ${message.role === 'user' ? 'justify-end' : 'justify-start'}`}
               >
                 <div
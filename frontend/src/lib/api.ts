@@ -1,5 +1,16 @@
+import { v4 as uuidv4 } from "uuid";
+
 export const API_BASE = import.meta.env.VITE_API_BASE ?? "http://localhost:8000";
 
+export class APIError extends Error {
+  status: number;
+
+  constructor(status: number, detail: string) {
+    super(`API Error ${status}: ${detail}`);
+    this.status = status;
+  }
+}
+
 export async function postJSON(path: string, body: any) {
   const response = await fetch(`${API_BASE}${path}`, {
     method: "POST",
@@ -31,4 +42,193 @@ export async function getJSON(path: string) {
   }
 
   return response.json();
-}
\ No newline at end of file
+}
+
+export type SSEHandler = (event: string, data: any) => void;
+
+// Pass the same idempotencyKey when retrying a request so the server replays the original reply
+export async function postSSE(path: string, body: any, onEvent: SSEHandler, idempotencyKey?: string) {
+  const headers: Record<string, string> = {
+    "Content-Type": "application/json",
+    Accept: "text/event-stream",
+  };
+  if (idempotencyKey) headers["Idempotency-Key"] = idempotencyKey;
+  const response = await fetch(`${API_BASE}${path}`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify(body),
+  });
+
+  if (!response.ok || !response.body) {
+    const errorText = await response.text();
+    throw new APIError(response.status, errorText);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      let event = "message";
+      let data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+export interface ChatSocketOptions {
+  tenantId: string;
+  agentName: string;
+  sessionId: string;
+  onPrompt?: (text: string) => void;
+}
+
+interface PendingTurn {
+  content: string;
+  text: string;
+  onText: (text: string) => void;
+  resolve: (done: any) => void;
+  reject: (error: Error) => void;
+}
+
+// Raised when the socket is gone for good; the caller should retry the turn over SSE
+export class ChatSocketClosed extends Error {}
+
+const WS_MAX_RETRIES = 5;
+const WS_MAX_BACKOFF_MS = 30000;
+
+/**
+ * Persistent widget session over /api/v1/chat/ws.
+ *
+ * Reconnects with exponential backoff (longer after 1013 "try again later")
+ * and resends unanswered messages with the same id, which the server answers
+ * from its idempotency store. Gives up after 1008 or WS_MAX_RETRIES failed
+ * attempts; `available` is false until the next successful `connect()`.
+ */
+export class ChatSocket {
+  private options: ChatSocketOptions;
+  private socket: WebSocket | null = null;
+  private ready = false;
+  private closed = false;
+  private retries = 0;
+  private retryTimer: ReturnType<typeof setTimeout> | null = null;
+  private pending = new Map<string, PendingTurn>();
+
+  constructor(options: ChatSocketOptions) {
+    this.options = options;
+  }
+
+  get available() {
+    return this.ready;
+  }
+
+  connect() {
+    if (this.closed || this.socket || this.retryTimer) return;
+    this.retries = 0;
+    this.open();
+  }
+
+  send(content: string, onText: (text: string) => void, id: string = uuidv4()): Promise<any> {
+    if (!this.socket || !this.ready) {
+      return Promise.reject(new ChatSocketClosed("WebSocket not connected"));
+    }
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { content, text: "", onText, resolve, reject });
+      this.socket!.send(JSON.stringify({ type: "message", id, content }));
+    });
+  }
+
+  close() {
+    this.closed = true;
+    if (this.retryTimer) clearTimeout(this.retryTimer);
+    this.socket?.close();
+    this.failPending(new ChatSocketClosed("WebSocket closed"));
+  }
+
+  private open() {
+    const params = new URLSearchParams({
+      tenant_id: this.options.tenantId,
+      agent_name: this.options.agentName,
+      session_id: this.options.sessionId,
+    });
+    const socket = new WebSocket(`${API_BASE.replace(/^http/, "ws")}/api/v1/chat/ws?${params}`);
+    this.socket = socket;
+    socket.onmessage = (event) => this.handle(JSON.parse(event.data));
+    socket.onclose = (event) => {
+      this.socket = null;
+      this.ready = false;
+      if (this.closed) return;
+      if (event.code === 1008 || this.retries >= WS_MAX_RETRIES) {
+        this.failPending(new ChatSocketClosed(`WebSocket closed (${event.code}) ${event.reason}`));
+        return;
+      }
+      // 1013: the server is at its connection limit, so back off harder
+      const base = event.code === 1013 ? 5000 : 500;
+      const delay = Math.min(base * 2 ** this.retries, WS_MAX_BACKOFF_MS);
+      this.retries += 1;
+      this.retryTimer = setTimeout(() => {
+        this.retryTimer = null;
+        this.open();
+      }, delay);
+    };
+  }
+
+  private handle(frame: any) {
+    const turn = frame.id ? this.pending.get(frame.id) : undefined;
+    switch (frame.type) {
+      case "ready":
+        this.ready = true;
+        this.retries = 0;
+        // Unanswered messages from before a reconnect; the server replays finished replies
+        for (const [id, pending] of this.pending) {
+          pending.text = "";
+          this.socket?.send(JSON.stringify({ type: "message", id, content: pending.content }));
+        }
+        break;
+      case "ping":
+        this.socket?.send(JSON.stringify({ type: "pong" }));
+        break;
+      case "token":
+        if (turn) {
+          turn.text += frame.content;
+          turn.onText(turn.text);
+        }
+        break;
+      case "done":
+        if (turn) {
+          this.pending.delete(frame.id);
+          turn.resolve(frame);
+        }
+        break;
+      case "error":
+        if (turn) {
+          this.pending.delete(frame.id);
+          turn.reject(new Error(`API Error ${frame.status}: ${frame.detail}`));
+        }
+        break;
+      case "prompt":
+        this.options.onPrompt?.(frame.text);
+        break;
+    }
+  }
+
+  private failPending(error: Error) {
+    for (const turn of this.pending.values()) turn.reject(error);
+    this.pending.clear();
+  }
+}